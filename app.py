@@ -1,7 +1,6 @@
 import json
 import os
-import sys
-import time
+from contextlib import nullcontext
 
 import click
 from dotenv import load_dotenv
@@ -10,41 +9,82 @@ load_dotenv()
 
 from documents.animals import documents
 
+from crud_ai.benchmark import compare, compression_sweep, hnsw_sweep, response_trimming, suite
+from crud_ai.config import EMBEDDING_CACHE_PATH, OPENAI_EMBEDDING_MODEL
+from crud_ai.embeddings import EmbeddingCache, Embedder
+from crud_ai.instrumentation import Metrics, to_prometheus
+from crud_ai.ingest import ingest as ingest_documents, read_documents
 from crud_ai.opensearch import (
+    bulk_index_documents,
+    bulk_load,
     create_openai_connector,
-    delete_connectors,
     delete_index,
-    delete_model,
-    delete_model_group,
     deploy_model,
     embedding_pipeline,
     embedding_template,
-    index_document,
+    estimate_shards,
+    estimate_vector_memory,
+    get_transport,
+    model_dimension,
+    hybrid_pipeline,
+    pq_sub_vectors,
     register_model,
     register_model_group,
+    register_search_templates,
     search_connectors,
     search_models,
     search_model_groups,
-    undeploy_model,
+    set_transport,
     update_cluster_settings,
     update_trusted_endpoints,
 )
+from crud_ai.reindex import blue_green
+from crud_ai.standin import Standin, serve, start
+from crud_ai.sync import sync as sync_documents
+from crud_ai.teardown import teardown as teardown_resources
+from crud_ai.throttle import Throttle
+from crud_ai.transport import Transport
 
 
 class Config:
     def __init__(self):
-        pass
+        self.metrics = None
+
+
+def start_standin(config, standin):
+    server = start(standin)
+    set_transport(
+        Transport(host=f"http://127.0.0.1:{server.server_port}", instrumentation=config.metrics)
+    )
+    return server
 
 
 @click.group()
+@click.option(
+    "--metrics",
+    "metrics_path",
+    envvar="CRUD_AI_METRICS",
+    type=click.Path(),
+    help="Instrument requests and write per-operation metrics to this JSON file",
+)
 @click.pass_context
-def cli(ctx):
+def cli(ctx, metrics_path):
     ctx.obj = Config()
 
+    if metrics_path and ctx.invoked_subcommand != "stats":
+        ctx.obj.metrics = get_transport().instrumentation = Metrics()
+
+        def write_metrics():
+            with open(metrics_path, "w", encoding="utf-8") as handle:
+                json.dump(ctx.obj.metrics.snapshot(), handle, indent=2)
+
+        ctx.call_on_close(write_metrics)
+
 
 @cli.command()
+@click.option("--expected-documents", default=0, show_default=True, help="Corpus size used to pick the shard count")
 @click.pass_obj
-def setup(config):
+def setup(config, expected_documents):
     click.echo("Updating cluster settings")
     response = update_cluster_settings()
     click.echo(json.dumps(response, indent=2))
@@ -72,7 +112,6 @@ def setup(config):
     click.echo("Registering OpenAI text embedding model")
     response = register_model('openai-text-embedding-ada-002', 'Embedding model', model_group_id, connector_id)
     click.echo(json.dumps(response, indent=2))
-    time.sleep(2)
 
     model_id = response['model_id']
 
@@ -80,61 +119,389 @@ def setup(config):
     response = deploy_model(model_id)
     click.echo(json.dumps(response, indent=2))
 
-    sys.exit()
-
     embedding_pipeline('embedding', model_id)
 
-    embedding_template('embedding', 'embedding')
+    hybrid_pipeline('hybrid')
+
+    register_search_templates()
+
+    embedding_template('embedding', 'embedding', number_of_shards=estimate_shards(expected_documents))
 
     delete_index('documents*')
 
-    for document in documents:
-        response = index_document(**document)
-        print(response)
+    response = bulk_index_documents(documents)
+    click.echo(json.dumps(response, indent=2))
 
 
-def teardown_models():
-    click.echo("Tearing down models")
+@cli.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--index", default="documents", show_default=True)
+@click.option("--pipeline", default=None, help="Ingest pipeline to run on each document")
+@click.option("--workers", default=4, show_default=True, help="Concurrent bulk requests")
+@click.option("--batch-size", default=500, show_default=True, help="Documents per bulk request")
+@click.option("--max-in-flight", default=None, type=int, help="Queued batches [default: 2 x workers]")
+@click.option("--embed/--no-embed", default=False, help="Compute embeddings client-side instead of in the pipeline")
+@click.option("--embedding-model", default=OPENAI_EMBEDDING_MODEL, show_default=True)
+@click.option("--embedding-batch-size", default=256, show_default=True, help="Inputs per embeddings request")
+@click.option("--embedding-cache", default=EMBEDDING_CACHE_PATH, show_default=True, type=click.Path())
+@click.option("--bulk-load/--no-bulk-load", "bulk_load_", default=False, help="Disable refresh and replicas during the load")
+@click.option("--force-merge", default=None, type=int, help="Force merge to this many segments after a bulk load")
+@click.option("--adaptive/--no-adaptive", default=False, help="Adjust batch size and workers to rejections and took")
+@click.option("--max-workers", default=16, show_default=True, help="Concurrency ceiling with --adaptive")
+@click.option("--target-took", default=2000.0, show_default=True, help="Bulk took in ms to aim for with --adaptive")
+@click.option("--retries", default=3, show_default=True, help="Resends of documents rejected under load")
+@click.pass_obj
+def ingest(
+    config,
+    paths,
+    index,
+    pipeline,
+    workers,
+    batch_size,
+    max_in_flight,
+    embed,
+    embedding_model,
+    embedding_batch_size,
+    embedding_cache,
+    bulk_load_,
+    force_merge,
+    adaptive,
+    max_workers,
+    target_took,
+    retries,
+):
+    last = 0.0
+    embedder = None
+    throttle = None
+
+    if adaptive:
+        throttle = Throttle(
+            batch_size=batch_size,
+            concurrency=workers,
+            max_concurrency=max_workers,
+            target_took=target_took,
+        )
+
+    if embed:
+        embedder = Embedder(
+            EmbeddingCache(embedding_cache),
+            model=embedding_model,
+            batch_size=embedding_batch_size,
+        )
+
+    def progress(stats):
+        nonlocal last
+        if stats.elapsed - last >= 1:
+            last = stats.elapsed
+            click.echo(
+                f"\r{stats.documents} docs, {stats.failed} failed, "
+                f"{stats.documents_per_second:.0f} docs/s, "
+                f"{stats.bytes_per_second / 1024:.0f} KiB/s"
+                + (f", batch {throttle.batch_size} x {throttle.concurrency}" if throttle else ""),
+                nl=False,
+                err=True,
+            )
+
+    with bulk_load(index, force_merge) if bulk_load_ else nullcontext():
+        stats = ingest_documents(
+            read_documents(paths),
+            index=index,
+            pipeline=pipeline,
+            workers=workers,
+            batch_size=batch_size,
+            max_in_flight=max_in_flight,
+            progress=progress,
+            embedder=embedder,
+            throttle=throttle,
+            retries=retries,
+        )
+    click.echo("", err=True)
+
+    result = stats.to_dict()
+    if throttle:
+        result["throttle"] = throttle.to_dict()
+    if embedder:
+        result["embeddings"] = embedder.stats()
+        embedder.close()
+    click.echo(json.dumps(result, indent=2))
 
-    response = search_models()
 
-    if response['hits']['total']['value']:
-        for hit in response['hits']['hits']:
-            model_id = hit['_id']
-            response = undeploy_model(model_id)
-            click.echo(json.dumps(response, indent=2))
-            response = delete_model(model_id)
-            click.echo(json.dumps(response, indent=2))
+@cli.command()
+@click.argument("paths", nargs=-1, type=click.Path(exists=True))
+@click.option("--index", default="documents", show_default=True)
+@click.option("--pipeline", default=None, help="Ingest pipeline to run on new and changed documents")
+@click.option("--delete/--no-delete", default=True, help="Delete indexed documents missing from the corpus")
+@click.option("--dry-run", is_flag=True, help="Only report what would change")
+@click.option("--embed/--no-embed", default=False, help="Compute embeddings client-side instead of in the pipeline")
+@click.option("--embedding-model", default=OPENAI_EMBEDDING_MODEL, show_default=True)
+@click.option("--embedding-cache", default=EMBEDDING_CACHE_PATH, show_default=True, type=click.Path())
+@click.pass_obj
+def sync(config, paths, index, pipeline, delete, dry_run, embed, embedding_model, embedding_cache):
+    embedder = None
+    if embed and not dry_run:
+        embedder = Embedder(EmbeddingCache(embedding_cache), model=embedding_model)
+
+    summary = sync_documents(
+        read_documents(paths) if paths else documents,
+        index=index,
+        pipeline=pipeline,
+        delete=delete,
+        dry_run=dry_run,
+        embedder=embedder,
+    )
 
+    if embedder:
+        summary["embeddings"] = embedder.stats()
+        embedder.close()
+    click.echo(json.dumps(summary, indent=2))
 
-def teardown_model_groups():
-    click.echo("Tearing down model groups")
 
-    response = search_model_groups('remote-models')
+@cli.command()
+@click.option("--alias", default="documents", show_default=True)
+@click.option("--version", default=None, help="Suffix of the new index [default: UTC timestamp]")
+@click.option("--skip-pipeline/--run-pipeline", default=False, help="Copy stored embeddings instead of recomputing them")
+@click.option("--slices", default="auto", show_default=True)
+@click.option("--requests-per-second", default=None, type=float, help="Throttle the copy")
+@click.option("--delete-old/--keep-old", default=False, help="Delete the previous indices after the swap")
+@click.pass_obj
+def reindex(config, alias, version, skip_pipeline, slices, requests_per_second, delete_old):
+    def progress(status):
+        copied = status["status"]["created"] + status["status"]["updated"]
+        seconds = status["running_time_in_nanos"] / 1e9
+        click.echo(
+            f"\r{copied}/{status['status']['total']} docs, {copied / (seconds or 1e-9):.0f} docs/s",
+            nl=False,
+            err=True,
+        )
+
+    summary = blue_green(
+        alias,
+        version=version,
+        skip_pipeline=skip_pipeline,
+        slices=slices,
+        requests_per_second=requests_per_second,
+        delete_old=delete_old,
+        progress=progress,
+    )
+    click.echo("", err=True)
+    click.echo(json.dumps(summary, indent=2))
 
-    if response['hits']['total']['value']:
-        model_group_id = response['hits']['hits'][0]['_id']
-        response = delete_model_group(model_group_id)
-        click.echo(json.dumps(response, indent=2))
 
+@cli.command()
+@click.option("--workers", default=8, show_default=True, help="Concurrent undeploy/delete calls")
+@click.pass_obj
+def teardown(config, workers):
+    click.echo("Tearing down models, model groups and connectors")
+    summary = teardown_resources('remote-models', 'openai-connector', workers=workers)
+    click.echo(json.dumps(summary, indent=2))
+    delete_index('documents*')
 
-def teardown_openai_connector():
-    click.echo("Tearing down OpenAI connectors")
-    response = delete_connectors('openai-connector')
 
-    if response:
-        click.echo(json.dumps(response, indent=2))
+@cli.command()
+@click.option("--model", default=OPENAI_EMBEDDING_MODEL, show_default=True, help="Embedding model giving the dimension")
+@click.option("--dimension", default=None, type=int, help="Override the model dimension")
+@click.option("--vectors", default=1_000_000, show_default=True)
+@click.option("--m", default=16, show_default=True, help="HNSW graph degree")
+@click.option("--pq-m", default=None, type=int, help="PQ sub-vectors [default: dimension / 8]")
+@click.option("--pq-code-size", default=8, show_default=True)
+@click.pass_obj
+def vector_memory(config, model, dimension, vectors, m, pq_m, pq_code_size):
+    dimension = dimension or model_dimension(model)
+    pq_m = pq_m or pq_sub_vectors(dimension)
+    estimates = {
+        "float": estimate_vector_memory(dimension, vectors, m),
+        "fp16": estimate_vector_memory(dimension, vectors, m, encoder="fp16"),
+        "byte": estimate_vector_memory(dimension, vectors, m, data_type="byte"),
+        "pq": estimate_vector_memory(
+            dimension, vectors, m, encoder="pq", pq_m=pq_m, pq_code_size=pq_code_size
+        ),
+    }
+    click.echo(json.dumps({
+        "dimension": dimension,
+        "vectors": vectors,
+        "gib": {name: round(size / 1024 ** 3, 3) for name, size in estimates.items()},
+    }, indent=2))
+
+
+def int_list(ctx, param, value):
+    return [int(item) for item in value.split(",")]
 
 
 @cli.command()
+@click.option("--documents", default=5000, show_default=True)
+@click.option("--queries", default=50, show_default=True)
+@click.option("--dimension", default=64, show_default=True)
+@click.option("--k", default=10, show_default=True)
+@click.option("--m", default="8,16,32", show_default=True, callback=int_list)
+@click.option("--ef-construction", default="64,128", show_default=True, callback=int_list)
+@click.option("--ef-search", default="16,64,256", show_default=True, callback=int_list)
+@click.option("--engine", default="faiss", show_default=True, type=click.Choice(["faiss", "lucene", "nmslib"]))
+@click.option("--output", default=None, type=click.Path(), help="Also write results to this JSON file")
 @click.pass_obj
-def teardown(config):
-    teardown_models()
-    time.sleep(2)
-    teardown_model_groups()
-    time.sleep(2)
-    teardown_openai_connector()
-    delete_index('documents*')
+def bench_hnsw(config, documents, queries, dimension, k, m, ef_construction, ef_search, engine, output):
+    results = hnsw_sweep(
+        documents=documents,
+        queries=queries,
+        dimension=dimension,
+        k=k,
+        m_values=m,
+        ef_construction_values=ef_construction,
+        ef_search_values=ef_search,
+        engine=engine,
+    )
+    click.echo(json.dumps(results, indent=2))
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+@cli.command()
+@click.option("--query", default="test", show_default=True)
+@click.option("--index", default="documents", show_default=True)
+@click.option("--size", default=10, show_default=True)
+@click.option("--runs", default=20, show_default=True)
+@click.pass_obj
+def bench_payload(config, query, index, size, runs):
+    click.echo(json.dumps(response_trimming(query, index, size, runs), indent=2))
+
+
+@cli.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=9200, show_default=True)
+@click.option("--dimension", default=64, show_default=True, help="Fake embedding dimension")
+@click.option("--latency", default=0.0, show_default=True, help="Milliseconds added to every request")
+@click.option("--embedding-latency", default=0.0, show_default=True, help="Milliseconds added to every embedding call")
+@click.option("--item-latency", default=0.0, show_default=True, help="Milliseconds spent per bulk document")
+@click.option("--bulk-queue", default=0, show_default=True, help="Concurrent bulk requests before 429s [0: unbounded]")
+@click.option("--bandwidth", default=0.0, show_default=True, help="Link speed in KiB/s per request [0: unlimited]")
+@click.pass_obj
+def standin(config, host, port, dimension, latency, embedding_latency, item_latency, bulk_queue, bandwidth):
+    server = serve(
+        host,
+        port,
+        Standin(
+            dimension,
+            latency / 1000,
+            embedding_latency / 1000,
+            item_latency / 1000,
+            bulk_queue,
+            bandwidth * 1024,
+        ),
+    )
+    click.echo(f"Stand-in listening on http://{host}:{server.server_port}", err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+@cli.command()
+@click.option("--documents", default=2000, show_default=True)
+@click.option("--queries", default=50, show_default=True)
+@click.option("--index", default="documents-bench", show_default=True)
+@click.option("--model-id", default=None, help="Model used by neural and combined searches")
+@click.option("--pipeline", default=None, help="Ingest pipeline that embeds documents")
+@click.option("--search-pipeline", default=None, help="Search pipeline for hybrid combined searches")
+@click.option("--workers", default=4, show_default=True)
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--standin/--no-standin", "use_standin", default=False, help="Run against an in-process stand-in")
+@click.option("--latency", default=0.0, show_default=True, help="Stand-in milliseconds per request")
+@click.option("--embedding-latency", default=0.0, show_default=True, help="Stand-in milliseconds per embedding call")
+@click.option("--output", default=None, type=click.Path(), help="Also write results to this JSON file")
+@click.option("--baseline", default=None, type=click.Path(exists=True), help="Earlier results to compare against")
+@click.pass_obj
+def bench(
+    config,
+    documents,
+    queries,
+    index,
+    model_id,
+    pipeline,
+    search_pipeline,
+    workers,
+    batch_size,
+    use_standin,
+    latency,
+    embedding_latency,
+    output,
+    baseline,
+):
+    server = None
+
+    if use_standin:
+        server = start_standin(
+            config, Standin(latency=latency / 1000, embedding_latency=embedding_latency / 1000)
+        )
+        model_id = model_id or "standin"
+        pipeline = pipeline or "embedding"
+        search_pipeline = search_pipeline or "hybrid"
+        embedding_pipeline(pipeline, model_id)
+        hybrid_pipeline(search_pipeline)
+
+    try:
+        results = suite(
+            documents=documents,
+            queries=queries,
+            index=index,
+            model_id=model_id,
+            pipeline=pipeline,
+            search_pipeline=search_pipeline,
+            workers=workers,
+            batch_size=batch_size,
+        )
+    finally:
+        if server:
+            server.shutdown()
+
+    results["meta"]["standin"] = use_standin
+    if use_standin:
+        results["meta"]["latency_ms"] = latency
+        results["meta"]["embedding_latency_ms"] = embedding_latency
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as handle:
+            results["change"] = compare(results, json.load(handle))
+
+    click.echo(json.dumps(results, indent=2))
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+@cli.command()
+@click.option("--batch-sizes", default="10,100,1000", show_default=True, callback=int_list)
+@click.option("--dimension", default=1536, show_default=True)
+@click.option("--runs", default=5, show_default=True)
+@click.option("--standin/--no-standin", "use_standin", default=False, help="Run against an in-process stand-in")
+@click.option("--bandwidth", default=10240.0, show_default=True, help="Stand-in link speed in KiB/s")
+@click.option("--output", default=None, type=click.Path(), help="Also write results to this JSON file")
+@click.pass_obj
+def bench_compression(config, batch_sizes, dimension, runs, use_standin, bandwidth, output):
+    server = start_standin(config, Standin(bandwidth=bandwidth * 1024)) if use_standin else None
+    try:
+        results = compression_sweep(batch_sizes, dimension, runs)
+    finally:
+        if server:
+            server.shutdown()
+
+    click.echo(json.dumps(results, indent=2))
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+@cli.command()
+@click.argument("path", type=click.Path(exists=True))
+@click.option("--format", "format_", default="json", show_default=True, type=click.Choice(["json", "prometheus"]))
+@click.pass_obj
+def stats(config, path, format_):
+    with open(path, encoding="utf-8") as handle:
+        snapshot = json.load(handle)
+
+    if format_ == "prometheus":
+        click.echo(to_prometheus(snapshot), nl=False)
+    else:
+        click.echo(json.dumps(snapshot, indent=2))
 
 
 @cli.command()
@@ -0,0 +1,503 @@
+"""
+Async OpenSearch API
+"""
+
+import asyncio
+import time
+
+import httpx
+
+from crud_ai import codec
+from crud_ai.backoff import delays
+from crud_ai.config import (
+    OPENSEARCH_CONNECT_TIMEOUT,
+    OPENSEARCH_HOST,
+    OPENSEARCH_POOL_SIZE,
+    OPENSEARCH_TIMEOUT,
+)
+from crud_ai.instrumentation import Metrics, current_operation, operation
+from crud_ai.transport import Compression, received_bytes
+from crud_ai.opensearch import (
+    DEFAULT_SOURCE_EXCLUDES,
+    ML_TASK_DONE_STATES,
+    ML_TASK_TIMEOUT,
+    document_params,
+    document_source,
+    get_query_vector_cache,
+    get_search_cache,
+    invalidate_search_cache,
+    normalize_query,
+    prepare_search_combined,
+    prepare_search_neural,
+    prepare_search_query,
+    search_cache_generation,
+    search_cache_key,
+    search_path,
+    store_search_result,
+)
+
+
+class AsyncTransport:
+    """
+    Pooled async HTTP transport with a bound on in-flight requests
+    """
+
+    def __init__(
+        self,
+        host: str = OPENSEARCH_HOST,
+        pool_size: int = OPENSEARCH_POOL_SIZE,
+        connect_timeout: float = OPENSEARCH_CONNECT_TIMEOUT,
+        timeout: float = OPENSEARCH_TIMEOUT,
+        concurrency: int = None,
+        client: httpx.AsyncClient = None,
+        instrumentation: Metrics = None,
+        compression: Compression = None,
+    ):
+        self.host = host.rstrip("/")
+        self.client = client or httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self.semaphore = asyncio.Semaphore(concurrency or pool_size)
+        self.instrumentation = instrumentation
+        self.compression = compression or Compression()
+
+    async def perform(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Send a request and return the raw response
+
+        A json body is serialized with the fast codec rather than by httpx,
+        and the body and accepted encodings follow the compression settings.
+        """
+        if kwargs.get("json") is not None:
+            kwargs["content"] = codec.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {"Content-Type": "application/json", **(kwargs.get("headers") or {})}
+        kwargs["content"], kwargs["headers"] = self.compression.encode(
+            current_operation(method, path), kwargs.get("content"), kwargs.get("headers")
+        )
+        async with self.semaphore:
+            return await self.client.request(method, f"{self.host}/{path}", **kwargs)
+
+    async def request(self, method: str, path: str, **kwargs):
+        """
+        Send a request and return the decoded JSON body, recording it when instrumented
+        """
+        if self.instrumentation is None:
+            response = await self.perform(method, path, **kwargs)
+            return codec.loads(response.content)
+
+        started = time.perf_counter()
+        response = await self.perform(method, path, **kwargs)
+        seconds = time.perf_counter() - started
+        body = codec.loads(response.content)
+        self.instrumentation.record(
+            current_operation(method, path),
+            response.status_code,
+            seconds,
+            len(response.request.content),
+            received_bytes(response),
+            body,
+        )
+        return body
+
+    async def aclose(self):
+        """
+        Close all pooled connections
+        """
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+_transport = None
+
+
+def get_transport() -> AsyncTransport:
+    """
+    Get the shared async transport, creating it on first use
+    """
+    global _transport
+    if _transport is None:
+        _transport = AsyncTransport()
+    return _transport
+
+
+def set_transport(transport: AsyncTransport) -> AsyncTransport:
+    """
+    Replace the shared async transport and return the previous one
+    """
+    global _transport
+    previous, _transport = _transport, transport
+    return previous
+
+
+async def request(method: str, path: str, **kwargs):
+    """
+    Make a request to the OpenSearch service
+    """
+    return await get_transport().request(method, path, **kwargs)
+
+
+async def search(index: str, payload: dict, params: dict = None):
+    """
+    Run a search payload against an index through the shared search result cache
+    """
+    path = search_path(index, payload)
+    cache = get_search_cache()
+    if cache is None or "pit" in payload:
+        return await request("get", path, params=params, json=payload)
+
+    key = search_cache_key(index, payload, params)
+    cached = cache.get(key)
+    if cached is not None:
+        return codec.loads(cached)
+
+    generation = search_cache_generation(index)
+    response = await request("get", path, params=params, json=payload)
+    store_search_result(key, generation, response)
+    return response
+
+
+@operation("predict_text_embedding")
+async def predict_text_embedding(model_id: str, texts: list) -> list:
+    """
+    Embed texts with a deployed text embedding model
+    """
+    response = await request(
+        "post",
+        f"_plugins/_ml/_predict/text_embedding/{model_id}",
+        json={"text_docs": texts},
+    )
+    return [result["output"][0]["data"] for result in response["inference_results"]]
+
+
+async def query_vector(query: str, model_id: str) -> list:
+    """
+    Get the embedding of a query through the shared query vector cache, or None when it is disabled
+    """
+    cache = get_query_vector_cache()
+    if cache is None or not model_id:
+        return None
+
+    query = normalize_query(query)
+    key = (model_id, query)
+    vector = cache.get(key)
+    if vector is None:
+        vector = (await predict_text_embedding(model_id, [query]))[0]
+        cache.set(key, vector)
+    return vector
+
+
+async def search_vector(query: str, model_id: str, filter_mode: str) -> list:
+    """
+    Get the query vector for a search; exact filtering always needs one
+    """
+    vector = await query_vector(query, model_id)
+    if vector is None and filter_mode == "exact":
+        vector = (await predict_text_embedding(model_id, [normalize_query(query)]))[0]
+    return vector
+
+
+@operation("search_query")
+async def search_query(
+    query: str,
+    filters: dict = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
+    """
+    Search for documents in the OpenSearch index using full text search
+    """
+    return await search(
+        *prepare_search_query(
+            query, filters, index, size, from_, sort, search_after, pit_id, keep_alive,
+            source_includes, source_excludes, filter_path,
+        )
+    )
+
+
+@operation("search_neural")
+async def search_neural(
+    query: str,
+    filters: dict = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
+    """
+    Search for documents in the OpenSearch index using neural search
+    """
+    vector = await search_vector(query, model_id, filter_mode)
+    return await search(
+        *prepare_search_neural(
+            query, filters, index, size, from_, model_id, k,
+            sort, search_after, pit_id, keep_alive, ef_search, filter_mode, space_type,
+            source_includes, source_excludes, filter_path, vector,
+        )
+    )
+
+
+@operation("search_combined")
+async def search_combined(
+    query: str,
+    filters: dict = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    fts_score: float = 1.0,
+    neural_score: float = 1.0,
+    search_pipeline: str = None,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
+    """
+    Search for documents in the OpenSearch index using full text search and neural search
+    """
+    vector = await search_vector(query, model_id, filter_mode)
+    return await search(
+        *prepare_search_combined(
+            query, filters, index, size, from_, model_id, k, fts_score, neural_score,
+            search_pipeline, sort, search_after, pit_id, keep_alive, ef_search,
+            filter_mode, space_type, source_includes, source_excludes, filter_path, vector,
+        )
+    )
+
+
+@operation("get_document")
+async def get_document(
+    id: str,
+    index: str = "documents",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
+    """
+    Get a document from the OpenSearch index
+    """
+    return await request(
+        "get",
+        f"{index}/_doc/{id}",
+        params=document_params(source_includes, source_excludes, filter_path),
+    )
+
+
+@operation("index_document")
+async def index_document(
+    id: str,
+    content: str,
+    content_type: str = "text/plain",
+    meta: dict = None,
+    index: str = "documents",
+    pipeline: str = None,
+    embedding: list = None,
+):
+    """
+    Index a document in the OpenSearch index
+    """
+    params = {}
+    if pipeline:
+        params["pipeline"] = pipeline
+    response = await request(
+        "put",
+        f"{index}/_doc/{id}",
+        params=params,
+        json=document_source(content, content_type, meta, embedding),
+    )
+    invalidate_search_cache(index)
+    return response
+
+
+@operation("delete_document")
+async def delete_document(id: str, index: str = "documents"):
+    """
+    Delete a document from the OpenSearch index
+    """
+    response = await request("delete", f"{index}/_doc/{id}")
+    invalidate_search_cache(index)
+    return response
+
+
+@operation("ml_task")
+async def wait_for_task(task_id: str, timeout: float = ML_TASK_TIMEOUT) -> dict:
+    """
+    Wait for an ML task to reach a final state, polling with jittered exponential backoff
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    for delay in delays():
+        task = await request("get", f"_plugins/_ml/tasks/{task_id}")
+        if task.get("state") in ML_TASK_DONE_STATES or "error" in task:
+            return task
+
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise TimeoutError(f"Timed out after {timeout}s waiting for ML task {task_id}")
+        await asyncio.sleep(min(delay, remaining))
+
+
+async def wait_for_tasks(task_ids: list, timeout: float = ML_TASK_TIMEOUT) -> dict:
+    """
+    Wait for many ML tasks concurrently, returning final tasks by id
+    """
+    tasks = await asyncio.gather(
+        *(wait_for_task(task_id, timeout) for task_id in task_ids)
+    )
+    return dict(zip(task_ids, tasks))
+
+
+async def ml_task(task: dict, timeout: float = ML_TASK_TIMEOUT):
+    """
+    Handle a task from the OpenSearch ML service, waiting for it to finish
+    """
+    if task.get("status") == "COMPLETED" or "task_id" not in task:
+        return task
+
+    return await wait_for_task(task["task_id"], timeout)
+
+
+@operation("upload_model")
+async def upload_model(
+    name: str, version: str, model_format: str, model_config: dict, url: str
+):
+    """
+    Upload a model to the OpenSearch service
+    """
+    return await ml_task(
+        await request(
+            "post",
+            "_plugins/_ml/models/_upload",
+            json={
+                "name": name,
+                "version": version,
+                "model_format": model_format,
+                "model_config": model_config,
+                "url": url,
+            },
+        )
+    )
+
+
+@operation("load_model")
+async def load_model(model_id: str):
+    """
+    Load a model in the OpenSearch service
+    """
+    return await ml_task(
+        await request(
+            "post",
+            f"_plugins/_ml/models/{model_id}/_load",
+        )
+    )
+
+
+@operation("unload_model")
+async def unload_model(model_id: str):
+    """
+    Unload a model from the OpenSearch service
+    """
+    return await request(
+        "post",
+        f"_plugins/_ml/models/{model_id}/_unload",
+    )
+
+
+@operation("register_model")
+async def register_model(name: str, description: str, model_group_id: str, connector_id: str):
+    """
+    Register a model in the OpenSearch service
+    """
+    return await ml_task(await request(
+        "post",
+        "_plugins/_ml/models/_register",
+        json={
+            "name": name,
+            "function_name": "remote",
+            "model_group_id": model_group_id,
+            "description": description,
+            "connector_id": connector_id,
+        }
+    ))
+
+
+@operation("deploy_model")
+async def deploy_model(model_id: str):
+    """
+    Deploy a model in the OpenSearch service
+    """
+    return await ml_task(await request(
+        "post",
+        f"_plugins/_ml/models/{model_id}/_deploy",
+    ))
+
+
+@operation("undeploy_model")
+async def undeploy_model(model_id: str):
+    """
+    Undeploy a model from the OpenSearch service
+    """
+    return await request(
+        "post",
+        f"_plugins/_ml/models/{model_id}/_undeploy",
+    )
+
+
+async def search_models():
+    """
+    Search for models in the OpenSearch service
+    """
+    return await request(
+        "get",
+        "_plugins/_ml/models/_search",
+        json={
+            "query": {
+                "match_all": {},
+            }
+        }
+    )
+
+
+@operation("delete_model")
+async def delete_model(id: str):
+    """
+    Delete a model from the OpenSearch service
+    """
+    return await request(
+        "delete",
+        f"_plugins/_ml/models/{id}"
+    )
@@ -0,0 +1,21 @@
+"""
+Exponential backoff with jitter
+"""
+
+import random
+from typing import Iterator
+
+
+def delays(
+    initial: float = 0.1,
+    maximum: float = 5.0,
+    multiplier: float = 2.0,
+) -> Iterator[float]:
+    """
+    Yield exponentially growing delays capped at maximum, each jittered
+    to between half and all of its nominal value
+    """
+    delay = initial
+    while True:
+        yield delay / 2 + random.uniform(0, delay / 2)
+        delay = min(delay * multiplier, maximum)
@@ -0,0 +1,400 @@
+"""
+Benchmarks against an OpenSearch service or the local stand-in
+"""
+
+import heapq
+import math
+import platform
+import random
+import time
+from datetime import datetime, timezone
+from itertools import product
+from typing import List
+
+from crud_ai import codec
+from crud_ai.ingest import ingest
+from crud_ai.instrumentation import Metrics, current_operation
+from crud_ai.opensearch import (
+    bulk,
+    create_index,
+    delete_index,
+    embedding_clause,
+    get_transport,
+    refresh_index,
+    request,
+    search_combined,
+    search_neural,
+    search_query,
+    search_query_payload,
+    select_source,
+    set_transport,
+    vector_method,
+)
+from crud_ai.transport import Compression, Transport
+
+TRIMMED_FILTER_PATH = "took,hits.total,hits.hits._id,hits.hits._score,hits.hits._source"
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Get the p-th percentile of values by nearest rank
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    """
+    Summarize latencies in seconds as millisecond percentiles
+    """
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+def random_vectors(count: int, dimension: int, seed: int = 0) -> List[List[float]]:
+    """
+    Generate reproducible random unit vectors
+    """
+    rng = random.Random(seed)
+    vectors = []
+    for _ in range(count):
+        vector = [rng.gauss(0, 1) for _ in range(dimension)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        vectors.append([value / norm for value in vector])
+    return vectors
+
+
+def exact_neighbours(vectors: List[List[float]], query: List[float], k: int) -> List[str]:
+    """
+    Find the ids of the k nearest vectors by brute-force L2 distance
+    """
+    distances = (
+        (sum((a - b) ** 2 for a, b in zip(vector, query)), str(id))
+        for id, vector in enumerate(vectors)
+    )
+    return [id for _, id in heapq.nsmallest(k, distances)]
+
+
+def hnsw_sweep(
+    documents: int = 5000,
+    queries: int = 50,
+    dimension: int = 64,
+    k: int = 10,
+    m_values: List[int] = (16,),
+    ef_construction_values: List[int] = (128,),
+    ef_search_values: List[int] = (100,),
+    engine: str = "faiss",
+    index_prefix: str = "bench-hnsw",
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Measure recall@k and query latency over a grid of HNSW settings
+
+    Each (m, ef_construction) pair gets its own index of random vectors, which
+    is searched with every ef_search and compared to exact neighbours.
+    """
+    vectors = random_vectors(documents, dimension, seed)
+    query_vectors = random_vectors(queries, dimension, seed + 1)
+    truth = [exact_neighbours(vectors, query, k) for query in query_vectors]
+    results = []
+
+    for m, ef_construction in product(m_values, ef_construction_values):
+        index = f"{index_prefix}-m{m}-efc{ef_construction}"
+        delete_index(index)
+        create_index(
+            index,
+            {
+                "settings": {
+                    "index.knn": True,
+                    "number_of_shards": 1,
+                    "number_of_replicas": 0,
+                },
+                "mappings": {
+                    "properties": {
+                        "embedding": {
+                            "type": "knn_vector",
+                            "dimension": dimension,
+                            "method": vector_method(
+                                engine=engine, m=m, ef_construction=ef_construction
+                            ),
+                        },
+                    },
+                },
+            },
+        )
+
+        started = time.perf_counter()
+        bulk(
+            (({"index": {"_id": str(id)}}, {"embedding": vector}) for id, vector in enumerate(vectors)),
+            index=index,
+        )
+        refresh_index(index)
+        build_seconds = time.perf_counter() - started
+
+        for ef_search in ef_search_values:
+            latencies, found = [], 0
+            for query, expected in zip(query_vectors, truth):
+                payload = {
+                    "query": embedding_clause(None, None, k, query, ef_search),
+                    "size": k,
+                    "_source": False,
+                }
+                started = time.perf_counter()
+                response = request("get", f"{index}/_search", json=payload)
+                latencies.append(time.perf_counter() - started)
+                hits = {hit["_id"] for hit in response["hits"]["hits"]}
+                found += len(hits & set(expected))
+
+            results.append(
+                {
+                    "engine": engine,
+                    "m": m,
+                    "ef_construction": ef_construction,
+                    "ef_search": ef_search,
+                    "build_seconds": round(build_seconds, 3),
+                    f"recall@{k}": round(found / (k * len(query_vectors)), 4),
+                    **latency_summary(latencies),
+                }
+            )
+
+        delete_index(index)
+
+    return results
+
+
+def response_trimming(
+    query: str = "test",
+    index: str = "documents",
+    size: int = 10,
+    runs: int = 20,
+) -> dict:
+    """
+    Compare response size and JSON decode time of full and trimmed search responses
+
+    The full variant returns every _source field and all metadata; the trimmed
+    one excludes embeddings and applies TRIMMED_FILTER_PATH.
+    """
+    variants = {
+        "full": (search_query_payload(query, size=size), None),
+        "trimmed": (
+            select_source(search_query_payload(query, size=size)),
+            {"filter_path": TRIMMED_FILTER_PATH},
+        ),
+    }
+    transport = get_transport()
+    results = {}
+
+    for name, (payload, params) in variants.items():
+        sizes, latencies, decodes = [], [], []
+        for _ in range(runs):
+            started = time.perf_counter()
+            response = transport.perform("get", f"{index}/_search", params=params, json=payload)
+            latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            codec.loads(response.content)
+            decodes.append(time.perf_counter() - started)
+            sizes.append(len(response.content))
+
+        results[name] = {
+            "response_bytes": round(sum(sizes) / runs),
+            "decode_ms": round(sum(decodes) / runs * 1000, 4),
+            **latency_summary(latencies),
+        }
+
+    results["bytes_saved"] = round(
+        1 - results["trimmed"]["response_bytes"] / (results["full"]["response_bytes"] or 1), 4
+    )
+    return results
+
+
+VOCABULARY = (
+    "cat dog bird fish horse whale eagle shark otter fox wolf bear lion tiger "
+    "river forest ocean desert mountain meadow reef tundra swamp island "
+    "hunts swims flies runs sleeps migrates nests grazes climbs dives "
+    "small large fast slow wild rare nocturnal social solitary colourful"
+).split()
+CATEGORIES = ("mammals", "birds", "fish", "reptiles")
+
+
+def synthetic_documents(count: int, words: int = 30, seed: int = 0):
+    """
+    Generate reproducible documents drawn from a small vocabulary
+    """
+    rng = random.Random(seed)
+    for id in range(count):
+        yield {
+            "id": f"bench-{id}",
+            "content": " ".join(rng.choices(VOCABULARY, k=words)),
+            "meta": {"category": rng.choice(CATEGORIES)},
+        }
+
+
+def synthetic_queries(count: int, words: int = 3, seed: int = 1) -> List[str]:
+    """
+    Generate reproducible short queries over the synthetic vocabulary
+    """
+    rng = random.Random(seed)
+    return [" ".join(rng.sample(VOCABULARY, words)) for _ in range(count)]
+
+
+def suite(
+    documents: int = 2000,
+    queries: int = 50,
+    index: str = "documents-bench",
+    model_id: str = None,
+    pipeline: str = None,
+    search_pipeline: str = None,
+    workers: int = 4,
+    batch_size: int = 500,
+    size: int = 10,
+    seed: int = 0,
+) -> dict:
+    """
+    Measure indexing throughput and query, neural and combined search latency
+
+    The index is recreated, loaded with synthetic documents (embedded by the
+    ingest pipeline) and searched with the same queries in each mode, so runs
+    with equal parameters are comparable.
+    """
+    delete_index(index)
+    stats = ingest(
+        synthetic_documents(documents, seed=seed),
+        index=index,
+        pipeline=pipeline,
+        workers=workers,
+        batch_size=batch_size,
+    )
+    refresh_index(index)
+
+    modes = {
+        "query": lambda query: search_query(query, index=index, size=size),
+        "neural": lambda query: search_neural(query, index=index, size=size, model_id=model_id, k=size),
+        "combined": lambda query: search_combined(
+            query, index=index, size=size, model_id=model_id, k=size, search_pipeline=search_pipeline
+        ),
+    }
+    texts = synthetic_queries(queries, seed=seed + 1)
+    search = {}
+
+    for mode, run in modes.items():
+        latencies, errors = [], 0
+        for text in texts:
+            started = time.perf_counter()
+            response = run(text)
+            latencies.append(time.perf_counter() - started)
+            errors += "error" in response
+        search[mode] = {"queries": len(texts), "errors": errors, **latency_summary(latencies)}
+
+    delete_index(index)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "host": get_transport().host,
+            "python": platform.python_version(),
+            "documents": documents,
+            "queries": queries,
+            "workers": workers,
+            "batch_size": batch_size,
+            "size": size,
+            "seed": seed,
+        },
+        "indexing": stats.to_dict(),
+        "search": search,
+    }
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    """
+    Relative change of every shared numeric metric between two suite results
+    """
+    changes = {}
+
+    def walk(current, baseline, path):
+        for key, value in current.items():
+            if key == "meta" or key not in baseline:
+                continue
+            if isinstance(value, dict):
+                walk(value, baseline[key], f"{path}{key}.")
+            elif isinstance(value, (int, float)) and isinstance(baseline[key], (int, float)) and baseline[key]:
+                changes[f"{path}{key}"] = round(value / baseline[key] - 1, 4)
+
+    walk(current, baseline, "")
+    return changes
+
+
+def compression_sweep(
+    batch_sizes: List[int] = (10, 100, 1000),
+    dimension: int = 1536,
+    runs: int = 5,
+    index: str = "bench-compression",
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Compare bulk throughput and vector-carrying search latency with gzip off and on
+
+    For each batch size, runs bulk requests of that many documents with
+    embeddings are sent, then runs searches return them all with their
+    embeddings. Byte counts are as sent over the wire.
+    """
+    original = get_transport()
+    vectors = random_vectors(max(batch_sizes), dimension, seed)
+    search_operation = current_operation("get", f"{index}/_search")
+    results = []
+
+    try:
+        for compressed in (False, True):
+            patterns = ("*",) if compressed else ()
+            metrics = Metrics()
+            transport = Transport(
+                original.host,
+                instrumentation=metrics,
+                compression=Compression(patterns, patterns, min_bytes=0),
+            )
+            set_transport(transport)
+
+            for batch_size in batch_sizes:
+                delete_index(index)
+                metrics.reset()
+                actions = [
+                    ({"index": {"_id": str(id)}}, {"content": f"document {id}", "embedding": vector})
+                    for id, vector in enumerate(vectors[:batch_size])
+                ]
+
+                started = time.perf_counter()
+                for _ in range(runs):
+                    bulk(actions, index=index, pipeline="_none")
+                seconds = time.perf_counter() - started
+                refresh_index(index)
+
+                payload = {"query": {"match_all": {}}, "size": batch_size}
+                latencies = []
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    request("get", f"{index}/_search", json=payload)
+                    latencies.append(time.perf_counter() - started)
+
+                operations = metrics.snapshot()["operations"]
+                results.append(
+                    {
+                        "compressed": compressed,
+                        "batch_size": batch_size,
+                        "documents_per_second": round(runs * batch_size / seconds, 1),
+                        "request_bytes": round(operations["bulk"]["bytes_sent"] / runs),
+                        "response_bytes": round(operations[search_operation]["bytes_received"] / runs),
+                        **latency_summary(latencies),
+                    }
+                )
+
+            transport.close()
+    finally:
+        set_transport(original)
+        delete_index(index)
+
+    return results
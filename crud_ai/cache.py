@@ -0,0 +1,84 @@
+"""
+In-process caches
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and optionally total bytes,
+    with an optional TTL and hit/miss counters
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, maxbytes: int = None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Get a live entry, refreshing its recency
+        """
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self.data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, size: int = 0):
+        """
+        Store an entry, evicting the least recently used ones over the bounds
+        """
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            if key in self.data:
+                self._remove(key)
+            self.data[key] = (value, expires, size)
+            self.bytes += size
+            while len(self.data) > self.maxsize or (
+                self.maxbytes is not None and self.bytes > self.maxbytes
+            ):
+                self._remove(next(iter(self.data)))
+
+    def invalidate(self, predicate: Callable[[object], bool]) -> int:
+        """
+        Remove the entries whose key matches predicate
+        """
+        with self.lock:
+            keys = [key for key in self.data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def _remove(self, key):
+        self.bytes -= self.data.pop(key)[2]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,28 @@
+"""
+JSON codec, using orjson when it is installed
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value, sort_keys: bool = False) -> bytes:
+    """
+    Serialize a value to compact JSON bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(value, separators=(",", ":"), sort_keys=sort_keys).encode()
+
+
+def loads(data):
+    """
+    Deserialize JSON bytes or text
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -5,3 +5,24 @@ load_dotenv()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 OPENSEARCH_HOST = os.environ.get("OPENSEARCH_HOST", "http://127.0.0.1:9200")
+OPENSEARCH_POOL_SIZE = int(os.environ.get("OPENSEARCH_POOL_SIZE", "10"))
+OPENSEARCH_CONNECT_TIMEOUT = float(os.environ.get("OPENSEARCH_CONNECT_TIMEOUT", "5"))
+OPENSEARCH_TIMEOUT = float(os.environ.get("OPENSEARCH_TIMEOUT", "30"))
+OPENSEARCH_COMPRESS_REQUESTS = [
+    pattern for pattern in os.environ.get("OPENSEARCH_COMPRESS_REQUESTS", "").split(",") if pattern
+]
+OPENSEARCH_COMPRESS_RESPONSES = [
+    pattern for pattern in os.environ.get("OPENSEARCH_COMPRESS_RESPONSES", "*").split(",") if pattern
+]
+OPENSEARCH_COMPRESSION_MIN_BYTES = int(os.environ.get("OPENSEARCH_COMPRESSION_MIN_BYTES", "1024"))
+OPENSEARCH_COMPRESSION_LEVEL = int(os.environ.get("OPENSEARCH_COMPRESSION_LEVEL", "1"))
+OPENAI_ORGANIZATION = os.environ.get("OPENAI_ORGANIZATION")
+OPENAI_EMBEDDINGS_URL = os.environ.get("OPENAI_EMBEDDINGS_URL", "https://api.openai.com/v1/embeddings")
+OPENAI_EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "data/embeddings.sqlite3")
+QUERY_VECTOR_CACHE_SIZE = int(os.environ.get("QUERY_VECTOR_CACHE_SIZE", "0"))
+QUERY_VECTOR_CACHE_TTL = float(os.environ.get("QUERY_VECTOR_CACHE_TTL", "3600"))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "0"))
+SEARCH_CACHE_BYTES = int(os.environ.get("SEARCH_CACHE_BYTES", str(64 * 1024 * 1024)))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "60"))
+SEARCH_CACHE_REFRESH_INTERVAL = float(os.environ.get("SEARCH_CACHE_REFRESH_INTERVAL", "1"))
@@ -0,0 +1,177 @@
+"""
+Client-side batched embeddings with a persistent content-hash cache
+"""
+
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crud_ai.config import (
+    EMBEDDING_CACHE_PATH,
+    OPENAI_API_KEY,
+    OPENAI_EMBEDDING_MODEL,
+    OPENAI_EMBEDDINGS_URL,
+    OPENAI_ORGANIZATION,
+    OPENSEARCH_POOL_SIZE,
+    OPENSEARCH_TIMEOUT,
+)
+
+
+def content_hash(text: str) -> str:
+    """
+    Hash text content for cache lookups
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite store of embeddings keyed by model name and content hash
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self.connection.commit()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """
+        Fetch the cached vectors for the given hashes
+        """
+        found = {}
+        with self.lock:
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = self.connection.execute(
+                    "SELECT hash, vector FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                )
+                for hash_, vector in rows:
+                    found[hash_] = array("f", vector).tolist()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        """
+        Store vectors by hash
+        """
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [
+                    (model, hash_, array("f", vector).tobytes())
+                    for hash_, vector in vectors.items()
+                ],
+            )
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class Embedder:
+    """
+    Batched client for an OpenAI-compatible embeddings endpoint backed by an EmbeddingCache
+    """
+
+    def __init__(
+        self,
+        cache: EmbeddingCache = None,
+        model: str = OPENAI_EMBEDDING_MODEL,
+        url: str = OPENAI_EMBEDDINGS_URL,
+        api_key: str = OPENAI_API_KEY,
+        organization: str = OPENAI_ORGANIZATION,
+        batch_size: int = 256,
+        timeout: float = OPENSEARCH_TIMEOUT,
+    ):
+        self.cache = cache or EmbeddingCache()
+        self.model = model
+        self.url = url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.session = requests.Session()
+        self.session.mount(
+            url, HTTPAdapter(pool_connections=1, pool_maxsize=OPENSEARCH_POOL_SIZE)
+        )
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        if organization:
+            self.session.headers["OpenAI-Organization"] = organization
+
+    def request(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts with a single call to the embeddings endpoint
+        """
+        with self.lock:
+            self.calls += 1
+        response = self.session.post(
+            self.url,
+            json={"input": texts, "model": self.model},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, only calling the endpoint for content missing from the cache
+        """
+        hashes = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model, list(set(hashes)))
+
+        missing = {}
+        for hash_, text in zip(hashes, texts):
+            if hash_ not in vectors:
+                missing.setdefault(hash_, text)
+
+        with self.lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            embedded = dict(
+                zip(
+                    [hash_ for hash_, _ in chunk],
+                    self.request([text for _, text in chunk]),
+                )
+            )
+            self.cache.put_many(self.model, embedded)
+            vectors.update(embedded)
+
+        return [vectors[hash_] for hash_ in hashes]
+
+    def embed_documents(self, documents: List[dict]) -> List[dict]:
+        """
+        Fill in the embedding of each document from its content
+        """
+        vectors = self.embed([document["content"] for document in documents])
+        return [
+            {**document, "embedding": vector}
+            for document, vector in zip(documents, vectors)
+        ]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"calls": self.calls, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.session.close()
+        self.cache.close()
@@ -0,0 +1,191 @@
+"""
+Parallel document ingestion
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List
+
+from crud_ai import codec
+from crud_ai.backoff import delays
+from crud_ai.embeddings import Embedder
+from crud_ai.opensearch import bulk_index_documents
+from crud_ai.throttle import Throttle, is_rejection, rejected_ids
+
+
+def read_documents(paths: Iterable[str]) -> Iterator[dict]:
+    """
+    Stream documents from JSONL files or directories of JSONL files
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+                if name.endswith(".jsonl")
+            )
+        else:
+            files = [path]
+
+        for file in files:
+            with open(file, encoding="utf-8") as handle:
+                for line in handle:
+                    if line.strip():
+                        yield codec.loads(line)
+
+
+def batched(documents: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    """
+    Group documents into lists of at most size items
+    """
+    iterator = iter(documents)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class IngestStats:
+    """
+    Running totals for an ingestion run, keeping the first max_errors item errors
+    """
+
+    max_errors = 100
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.documents = 0
+        self.bytes = 0
+        self.failed = 0
+        self.retried = 0
+        self.errors = []
+
+    def add(self, summary: dict):
+        """
+        Fold a bulk summary into the totals
+        """
+        self.documents += summary["succeeded"] + summary["failed"]
+        self.bytes += summary["bytes"]
+        self.failed += summary["failed"]
+        self.retried += summary.get("retried", 0)
+        self.errors.extend(
+            {key: value for key, value in error.items() if key != "_ids"}
+            for error in summary["errors"][: self.max_errors - len(self.errors)]
+        )
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def documents_per_second(self) -> float:
+        return self.documents / (self.elapsed or 1e-9)
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / (self.elapsed or 1e-9)
+
+    def to_dict(self) -> dict:
+        return {
+            "documents": self.documents,
+            "failed": self.failed,
+            "retried": self.retried,
+            "bytes": self.bytes,
+            "elapsed": round(self.elapsed, 3),
+            "documents_per_second": round(self.documents_per_second, 1),
+            "bytes_per_second": round(self.bytes_per_second, 1),
+            "errors": self.errors,
+        }
+
+
+def ingest(
+    documents: Iterable[dict],
+    index: str = "documents",
+    pipeline: str = None,
+    workers: int = 4,
+    batch_size: int = 500,
+    max_in_flight: int = None,
+    progress: Callable[[IngestStats], None] = None,
+    embedder: Embedder = None,
+    throttle: Throttle = None,
+    retries: int = 3,
+) -> IngestStats:
+    """
+    Index documents through a worker pool, keeping at most max_in_flight batches in memory
+
+    With an embedder, vectors are computed client-side and the ingest pipeline
+    defaults to _none so the server does not embed them again. With a
+    throttle, the batch size and the number of batches in flight follow it
+    instead of batch_size and max_in_flight. Documents rejected under load
+    (429 or es_rejected_execution_exception) are resent on their own, up to
+    retries times with jittered backoff.
+    """
+    max_in_flight = max_in_flight or workers * 2
+    stats = IngestStats()
+
+    if embedder:
+        pipeline = pipeline or "_none"
+    if throttle:
+        workers = throttle.max_concurrency
+
+    def send(batch):
+        started = time.monotonic()
+        summary = bulk_index_documents(
+            batch,
+            index=index,
+            pipeline=pipeline,
+            chunk_size=len(batch),
+        )
+        retry = rejected_ids(summary)
+        if throttle:
+            throttle.observe(started, summary["took"], len(batch), len(retry))
+        return summary, retry
+
+    def index_batch(batch):
+        if embedder:
+            batch = embedder.embed_documents(batch)
+
+        total = {"took": 0, "bytes": 0, "succeeded": 0, "failed": 0, "retried": 0, "errors": []}
+        backoff = delays()
+        for attempt in range(retries + 1):
+            summary, retry = send(batch)
+            total["took"] += summary["took"]
+            total["bytes"] += summary["bytes"]
+            total["succeeded"] += summary["succeeded"]
+
+            batch = [document for document in batch if str(document["id"]) in retry]
+            if not batch or attempt == retries:
+                total["failed"] += summary["failed"]
+                total["errors"].extend(summary["errors"])
+                break
+
+            # Rejected ids that match no document here stay counted as failed
+            retried = min(len(batch), summary["failed"])
+            total["failed"] += summary["failed"] - retried
+            total["errors"].extend(
+                error for error in summary["errors"]
+                if not is_rejection(error.get("status"), error.get("error"))
+            )
+            total["retried"] += retried
+            time.sleep(next(backoff))
+
+        return total
+
+    def collect(done):
+        for future in done:
+            stats.add(future.result())
+            if progress:
+                progress(stats)
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = set()
+        iterator = iter(documents)
+        while batch := list(islice(iterator, throttle.batch_size if throttle else batch_size)):
+            while len(pending) >= (throttle.concurrency if throttle else max_in_flight):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(index_batch, batch))
+        collect(wait(pending).done)
+
+    return stats
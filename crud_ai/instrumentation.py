@@ -0,0 +1,167 @@
+"""
+Per-operation latency and payload instrumentation for the transports
+"""
+
+import functools
+import inspect
+import threading
+from contextvars import ContextVar
+from typing import Callable
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_operation = ContextVar("operation", default=None)
+
+
+def current_operation(method: str, path: str) -> str:
+    """
+    Get the logical operation of a request, falling back to its method and API endpoint
+    """
+    name = _operation.get()
+    if name:
+        return name
+    endpoint = "/".join(part for part in path.split("/") if part.startswith("_"))
+    return f"{method.lower()} {endpoint or 'index'}"
+
+
+def operation(name: str) -> Callable:
+    """
+    Label the requests made by a sync or async function with a logical operation name
+    """
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                token = _operation.set(name)
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    _operation.reset(token)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            token = _operation.set(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _operation.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+class Metrics:
+    """
+    Thread-safe request metrics grouped by logical operation
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def record(
+        self,
+        operation: str,
+        status: int,
+        seconds: float,
+        bytes_sent: int,
+        bytes_received: int,
+        body: dict = None,
+    ):
+        """
+        Record one request, with the server took and timed_out when the body has them
+        """
+        with self.lock:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = {
+                    "count": 0,
+                    "seconds_sum": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "status": {},
+                    "took_ms_sum": 0,
+                    "timed_out": 0,
+                }
+
+            stats["count"] += 1
+            stats["seconds_sum"] += seconds
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    break
+            else:
+                position = len(self.buckets)
+            stats["buckets"][position] += 1
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["status"][str(status)] = stats["status"].get(str(status), 0) + 1
+
+            if isinstance(body, dict):
+                stats["took_ms_sum"] += body.get("took") or 0
+                stats["timed_out"] += bool(body.get("timed_out"))
+
+    def snapshot(self) -> dict:
+        """
+        Get a JSON-serializable copy of the metrics with cumulative buckets
+        """
+        with self.lock:
+            operations = {}
+            for name, stats in self.operations.items():
+                cumulative, total = {}, 0
+                for bound, count in zip(self.buckets + ("+Inf",), stats["buckets"]):
+                    total += count
+                    cumulative[str(bound)] = total
+                operations[name] = {
+                    **stats,
+                    "status": dict(stats["status"]),
+                    "buckets": cumulative,
+                    "mean_ms": round(stats["seconds_sum"] / stats["count"] * 1000, 3),
+                }
+            return {"operations": operations}
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+
+
+def to_prometheus(snapshot: dict, prefix: str = "crud_ai") -> str:
+    """
+    Render a metrics snapshot in the Prometheus text exposition format
+    """
+    operations = snapshot["operations"]
+    lines = [
+        f"# HELP {prefix}_request_seconds Client latency of OpenSearch requests",
+        f"# TYPE {prefix}_request_seconds histogram",
+    ]
+    for name, stats in operations.items():
+        for bound, count in stats["buckets"].items():
+            lines.append(f'{prefix}_request_seconds_bucket{{operation="{name}",le="{bound}"}} {count}')
+        lines.append(f'{prefix}_request_seconds_sum{{operation="{name}"}} {stats["seconds_sum"]}')
+        lines.append(f'{prefix}_request_seconds_count{{operation="{name}"}} {stats["count"]}')
+
+    counters = (
+        ("request_bytes_sent_total", "bytes_sent", "Request body bytes sent"),
+        ("response_bytes_received_total", "bytes_received", "Response body bytes received"),
+        ("server_took_milliseconds_total", "took_ms_sum", "Server-side took reported by OpenSearch"),
+        ("timed_out_total", "timed_out", "Responses reporting timed_out"),
+    )
+    for metric, field, help in counters:
+        lines.append(f"# HELP {prefix}_{metric} {help}")
+        lines.append(f"# TYPE {prefix}_{metric} counter")
+        for name, stats in operations.items():
+            lines.append(f'{prefix}_{metric}{{operation="{name}"}} {stats[field]}')
+
+    lines.append(f"# HELP {prefix}_responses_total Responses by HTTP status")
+    lines.append(f"# TYPE {prefix}_responses_total counter")
+    for name, stats in operations.items():
+        for status, count in stats["status"].items():
+            lines.append(f'{prefix}_responses_total{{operation="{name}",status="{status}"}} {count}')
+
+    return "\n".join(lines) + "\n"
@@ -2,29 +2,410 @@
 OpenSearch API
 """
 
-import requests
+import math
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from typing import Iterable, Iterator, List, Tuple
+
+from crud_ai import codec
+from crud_ai.backoff import delays
+from crud_ai.cache import LRUCache
+from crud_ai.config import (
+    OPENAI_EMBEDDING_MODEL,
+    QUERY_VECTOR_CACHE_SIZE,
+    QUERY_VECTOR_CACHE_TTL,
+    SEARCH_CACHE_BYTES,
+    SEARCH_CACHE_REFRESH_INTERVAL,
+    SEARCH_CACHE_SIZE,
+    SEARCH_CACHE_TTL,
+)
+from crud_ai.instrumentation import operation
+from crud_ai.transport import Transport
+
+_transport = None
+_query_vectors = (
+    LRUCache(QUERY_VECTOR_CACHE_SIZE, QUERY_VECTOR_CACHE_TTL)
+    if QUERY_VECTOR_CACHE_SIZE
+    else None
+)
+_search_results = (
+    LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_BYTES)
+    if SEARCH_CACHE_SIZE
+    else None
+)
+
+
+def get_transport() -> Transport:
+    """
+    Get the shared transport, creating it on first use
+    """
+    global _transport
+    if _transport is None:
+        _transport = Transport()
+    return _transport
+
 
-from crud_ai.config import OPENSEARCH_HOST
+def set_transport(transport: Transport) -> Transport:
+    """
+    Replace the shared transport and return the previous one
+    """
+    global _transport
+    previous, _transport = _transport, transport
+    return previous
 
 
 def request(method: str, path: str, **kwargs):
     """
     Make a request to the OpenSearch service
     """
-    url = f"{OPENSEARCH_HOST}/{path}"
-    response = requests.request(method, url, timeout=30, **kwargs)
-    return response.json()
+    return get_transport().request(method, path, **kwargs)
 
 
-def search_query(
+def get_query_vector_cache() -> LRUCache:
+    """
+    Get the query embedding cache, or None when disabled
+    """
+    return _query_vectors
+
+
+def set_query_vector_cache(cache: LRUCache) -> LRUCache:
+    """
+    Replace the query embedding cache (None disables it) and return the previous one
+    """
+    global _query_vectors
+    previous, _query_vectors = _query_vectors, cache
+    return previous
+
+
+def get_search_cache() -> LRUCache:
+    """
+    Get the search result cache, or None when disabled
+    """
+    return _search_results
+
+
+def set_search_cache(cache: LRUCache) -> LRUCache:
+    """
+    Replace the search result cache (None disables it) and return the previous one
+    """
+    global _search_results
+    previous, _search_results = _search_results, cache
+    return previous
+
+
+_writes = {}
+_writes_lock = threading.Lock()
+_write_generation = 0
+
+
+def _index_names(index: str) -> list:
+    return [name.strip() for name in index.split(",") if name.strip()]
+
+
+def _overlaps(left: str, right: str) -> bool:
+    return any(
+        fnmatch(a, b) or fnmatch(b, a)
+        for a in _index_names(left)
+        for b in _index_names(right)
+    )
+
+
+def invalidate_search_cache(index: str, pending: bool = False) -> int:
+    """
+    Drop cached search results for any index overlapping the given names or patterns
+
+    The write is also recorded, so that searches in flight and searches
+    before the next refresh do not cache results that miss it. A pending
+    write is one still running on the server (an asynchronous task): no
+    results are cached for the index until it is invalidated again, for
+    instance by refresh_index.
+    """
+    global _write_generation
+    if _search_results is None:
+        return 0
+
+    with _writes_lock:
+        _write_generation += 1
+        written = math.inf if pending else time.monotonic()
+        for name in _index_names(index):
+            _writes[name] = (_write_generation, written)
+
+    return _search_results.invalidate(lambda key: _overlaps(key[0], index))
+
+
+def search_cache_generation(index: str):
+    """
+    Get the write generation of an index, read before searching it
+
+    None means a write may not be visible to searches yet (it is within
+    SEARCH_CACHE_REFRESH_INTERVAL), so the results must not be cached.
+    """
+    now = time.monotonic()
+    generation = 0
+    with _writes_lock:
+        for name, (count, written) in _writes.items():
+            if _overlaps(name, index):
+                if now - written < SEARCH_CACHE_REFRESH_INTERVAL:
+                    return None
+                generation = max(generation, count)
+    return generation
+
+
+def store_search_result(key: tuple, generation, response: dict):
+    """
+    Cache a search response unless it failed or the index was written since generation was read
+    """
+    if (
+        _search_results is None
+        or generation is None
+        or "error" in response
+        or search_cache_generation(key[0]) != generation
+    ):
+        return
+    body = codec.dumps(response)
+    _search_results.set(key, body, len(key[1]) + len(body))
+
+
+def search_cache_key(index: str, payload: dict, params: dict = None) -> tuple:
+    """
+    Build the search result cache key for a payload and query parameters against an index
+    """
+    return (index, codec.dumps([payload, params or {}], sort_keys=True))
+
+
+def search_path(index: str, payload: dict) -> str:
+    """
+    Get the search endpoint for a payload; point in time searches must not name an index
+    """
+    return "_search" if "pit" in payload else f"{index}/_search"
+
+
+def search(index: str, payload: dict, params: dict = None):
+    """
+    Run a search payload against an index through the search result cache
+    """
+    path = search_path(index, payload)
+    if _search_results is None or "pit" in payload:
+        return request("get", path, params=params, json=payload)
+
+    key = search_cache_key(index, payload, params)
+    cached = _search_results.get(key)
+    if cached is not None:
+        return codec.loads(cached)
+
+    generation = search_cache_generation(index)
+    response = request("get", path, params=params, json=payload)
+    store_search_result(key, generation, response)
+    return response
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize query text for embedding and cache lookups
+    """
+    return " ".join(query.split())
+
+
+@operation("predict_text_embedding")
+def predict_text_embedding(model_id: str, texts: list) -> list:
+    """
+    Embed texts with a deployed text embedding model
+    """
+    response = request(
+        "post",
+        f"_plugins/_ml/_predict/text_embedding/{model_id}",
+        json={"text_docs": texts},
+    )
+    return [result["output"][0]["data"] for result in response["inference_results"]]
+
+
+def query_vector(query: str, model_id: str) -> list:
+    """
+    Get the embedding of a query through the query vector cache, or None when it is disabled
+    """
+    if _query_vectors is None or not model_id:
+        return None
+
+    query = normalize_query(query)
+    key = (model_id, query)
+    vector = _query_vectors.get(key)
+    if vector is None:
+        vector = predict_text_embedding(model_id, [query])[0]
+        _query_vectors.set(key, vector)
+    return vector
+
+
+FILTER_MODES = ("pre", "post", "exact")
+
+
+def search_vector(query: str, model_id: str, filter_mode: str) -> list:
+    """
+    Get the query vector for a search; exact filtering always needs one
+    """
+    vector = query_vector(query, model_id)
+    if vector is None and filter_mode == "exact":
+        vector = predict_text_embedding(model_id, [normalize_query(query)])[0]
+    return vector
+
+
+def embedding_clause(
+    query: str,
+    model_id: str,
+    k: int,
+    vector: list = None,
+    ef_search: int = None,
+    filters: list = None,
+    exact: bool = False,
+    space_type: str = "l2",
+) -> dict:
+    """
+    Build a k-NN clause on the embedding field, using the raw vector when one is given
+
+    filters are applied inside the clause, so the engine runs efficient
+    filtered k-NN. With exact, the vector is scored by brute force against
+    every document matching filters instead.
+    """
+    if exact:
+        return {
+            "script_score": {
+                "query": {"bool": {"filter": filters}} if filters else {"match_all": {}},
+                "script": {
+                    "source": "knn_score",
+                    "lang": "knn",
+                    "params": {
+                        "field": "embedding",
+                        "query_value": vector,
+                        "space_type": space_type,
+                    },
+                },
+            },
+        }
+
+    if vector is not None:
+        clause = {
+            "knn": {
+                "embedding": {
+                    "vector": vector,
+                    "k": k,
+                },
+            },
+        }
+    else:
+        clause = {
+            "neural": {
+                "embedding": {
+                    "query_text": query,
+                    "model": model_id,
+                    "k": k,
+                },
+            },
+        }
+    options = next(iter(clause.values()))["embedding"]
+    if ef_search:
+        options["method_parameters"] = {"ef_search": ef_search}
+    if filters:
+        options["filter"] = {"bool": {"filter": filters}}
+    return clause
+
+
+def filtered_embedding_clause(
+    query: str,
+    model_id: str,
+    k: int,
+    vector: list,
+    ef_search: int,
+    filters: list,
+    filter_mode: str,
+    space_type: str = "l2",
+) -> dict:
+    """
+    Build the k-NN clause for a filter mode; post filtering leaves filters to the caller
+
+    space_type must match the index mapping for exact scores to rank like k-NN ones.
+    """
+    if filter_mode not in FILTER_MODES:
+        raise ValueError(f"Unknown filter mode: {filter_mode}")
+    if filter_mode == "post":
+        return embedding_clause(query, model_id, k, vector, ef_search)
+    return embedding_clause(
+        query, model_id, k, vector, ef_search, filters,
+        exact=filter_mode == "exact", space_type=space_type,
+    )
+
+
+WEIGHTED_SCORE_SCRIPT = "_score * params.weight"
+DEFAULT_SORT = [{"_score": "desc"}, {"_doc": "asc"}]
+
+
+def paginate(
+    payload: dict,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+) -> dict:
+    """
+    Add sort, search_after and point in time options to a search payload
+
+    search_after and point in time pagination need a total sort order, so
+    DEFAULT_SORT is applied when neither sort nor an existing one is given.
+    """
+    if sort:
+        payload["sort"] = sort
+    if search_after is not None or pit_id:
+        payload.setdefault("sort", DEFAULT_SORT)
+    if search_after is not None:
+        payload["search_after"] = search_after
+        payload.pop("from", None)
+    if pit_id:
+        payload["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+    return payload
+
+
+DEFAULT_SOURCE_EXCLUDES = ("embedding",)
+
+
+def select_source(
+    payload: dict,
+    includes: list = None,
+    excludes: list = DEFAULT_SOURCE_EXCLUDES,
+) -> dict:
+    """
+    Limit the _source fields returned by a search payload; embeddings are excluded by default
+    """
+    source = {}
+    if includes:
+        source["includes"] = list(includes)
+    if excludes:
+        source["excludes"] = list(excludes)
+    if source:
+        payload["_source"] = source
+    return payload
+
+
+def search_params(search_pipeline: str = None, filter_path: str = None) -> dict:
+    """
+    Build the query parameters of a search, or None when there are none
+    """
+    params = {}
+    if search_pipeline:
+        params["search_pipeline"] = search_pipeline
+    if filter_path:
+        params["filter_path"] = filter_path
+    return params or None
+
+
+def search_query_payload(
     query: str,
     filters: dict = None,
-    index: str = "documents",
     size: int = 10,
     from_: int = 0,
-):
+) -> dict:
     """
-    Search for documents in the OpenSearch index using full text search
+    Build the full text search payload
     """
     payload = {
         "query": {
@@ -43,46 +424,96 @@ def search_query(
     }
     if filters:
         payload["query"]["bool"]["filter"] = filters
-    return request("get", f"{index}/_search", json=payload)
+    return payload
 
 
-def search_neural(
+def prepare_search_query(
     query: str,
     filters: dict = None,
     index: str = "documents",
     size: int = 10,
     from_: int = 0,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+) -> Tuple[str, dict, dict]:
+    """
+    Build the index, payload and query parameters of a full text search
+    """
+    payload = search_query_payload(query, filters, size, from_)
+    payload = paginate(payload, sort, search_after, pit_id, keep_alive)
+    payload = select_source(payload, source_includes, source_excludes)
+    return index, payload, search_params(filter_path=filter_path)
+
+
+@operation("search_query")
+def search_query(
+    query: str,
+    filters: dict = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
+    """
+    Search for documents in the OpenSearch index using full text search
+    """
+    return search(
+        *prepare_search_query(
+            query, filters, index, size, from_, sort, search_after, pit_id, keep_alive,
+            source_includes, source_excludes, filter_path,
+        )
+    )
+
+
+def search_neural_payload(
+    query: str,
+    filters: dict = None,
+    size: int = 10,
+    from_: int = 0,
     model_id: str = None,
     k: int = 10,
-):
+    vector: list = None,
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+) -> dict:
     """
-    Search for documents in the OpenSearch index using neural search
+    Build the neural search payload
+
+    filter_mode "pre" filters inside the k-NN clause, "post" filters the k
+    neighbours afterwards and "exact" scores every filtered document.
     """
     payload = {
         "query": {
             "bool": {
                 "should": [
-                    {
-                        "neural": {
-                            "embedding": {
-                                "query_text": query,
-                                "model": model_id,
-                                "k": k,
-                            },
-                        },
-                    }
+                    filtered_embedding_clause(
+                        query, model_id, k, vector, ef_search, filters, filter_mode,
+                        space_type,
+                    ),
                 ],
             },
         },
         "size": size,
         "from": from_,
     }
-    if filters:
+    if filters and filter_mode == "post":
         payload["query"]["bool"]["filter"] = filters
-    return request("get", f"{index}/_search", json=payload)
+    return payload
 
 
-def search_combined(
+def prepare_search_neural(
     query: str,
     filters: dict = None,
     index: str = "documents",
@@ -90,11 +521,86 @@ def search_combined(
     from_: int = 0,
     model_id: str = None,
     k: int = 10,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+    vector: list = None,
+) -> Tuple[str, dict, dict]:
+    """
+    Build the index, payload and query parameters of a neural search
+
+    vector is the query embedding when the caller already has it.
+    """
+    if vector is None:
+        vector = search_vector(query, model_id, filter_mode)
+    payload = search_neural_payload(
+        query, filters, size, from_, model_id, k, vector, ef_search, filter_mode,
+        space_type,
+    )
+    payload = paginate(payload, sort, search_after, pit_id, keep_alive)
+    payload = select_source(payload, source_includes, source_excludes)
+    return index, payload, search_params(filter_path=filter_path)
+
+
+@operation("search_neural")
+def search_neural(
+    query: str,
+    filters: dict = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
+    """
+    Search for documents in the OpenSearch index using neural search
+    """
+    return search(
+        *prepare_search_neural(
+            query, filters, index, size, from_, model_id, k,
+            sort, search_after, pit_id, keep_alive, ef_search, filter_mode, space_type,
+            source_includes, source_excludes, filter_path,
+        )
+    )
+
+
+def search_combined_payload(
+    query: str,
+    filters: dict = None,
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
     fts_score: float = 1.0,
     neural_score: float = 1.0,
-):
+    vector: list = None,
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+) -> dict:
     """
-    Search for documents in the OpenSearch index using full text search and neural search
+    Build the combined full text and neural search payload
+
+    The weights are passed as script params so every weight pair shares one
+    compiled script. filters always apply to the full text clause and reach
+    the k-NN clause according to filter_mode (see search_neural_payload).
     """
     payload = {
         "query": {
@@ -108,23 +614,20 @@ def search_combined(
                                 },
                             },
                             "script": {
-                                "source": f"_score * {fts_score}",
+                                "source": WEIGHTED_SCORE_SCRIPT,
+                                "params": {"weight": fts_score},
                             },
                         },
                     },
                     {
                         "script_score": {
-                            "query": {
-                                "neural": {
-                                    "embedding": {
-                                        "query_text": query,
-                                        "model": model_id,
-                                        "k": k,
-                                    },
-                                },
-                            },
+                            "query": filtered_embedding_clause(
+                                query, model_id, k, vector, ef_search, filters, filter_mode,
+                                space_type,
+                            ),
                             "script": {
-                                "source": f"_score * {neural_score}",
+                                "source": WEIGHTED_SCORE_SCRIPT,
+                                "params": {"weight": neural_score},
                             },
                         },
                     },
@@ -136,16 +639,525 @@ def search_combined(
     }
     if filters:
         payload["query"]["bool"]["filter"] = filters
-    return request("get", f"{index}/_search", json=payload)
+    return payload
+
+
+def search_hybrid_payload(
+    query: str,
+    filters: dict = None,
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    vector: list = None,
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+) -> dict:
+    """
+    Build a hybrid query payload, to be blended by a normalization search pipeline
+    """
+    text_query = {
+        "match": {
+            "content": query,
+        },
+    }
+    knn_query = filtered_embedding_clause(
+        query, model_id, k, vector, ef_search, filters, filter_mode, space_type
+    )
+    if filters:
+        text_query = {"bool": {"must": [text_query], "filter": filters}}
+        if filter_mode == "post":
+            knn_query = {"bool": {"must": [knn_query], "filter": filters}}
+
+    queries = [text_query, knn_query]
+    return {
+        "query": {
+            "hybrid": {
+                "queries": queries,
+            },
+        },
+        "size": size,
+        "from": from_,
+    }
+
+
+def prepare_search_combined(
+    query: str,
+    filters: dict = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    fts_score: float = 1.0,
+    neural_score: float = 1.0,
+    search_pipeline: str = None,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+    vector: list = None,
+) -> Tuple[str, dict, dict]:
+    """
+    Build the index, payload and query parameters of a combined search
+
+    vector is the query embedding when the caller already has it.
+    """
+    if vector is None:
+        vector = search_vector(query, model_id, filter_mode)
+    if search_pipeline:
+        payload = search_hybrid_payload(
+            query, filters, size, from_, model_id, k, vector, ef_search, filter_mode,
+            space_type,
+        )
+    else:
+        payload = search_combined_payload(
+            query, filters, size, from_, model_id, k, fts_score, neural_score, vector,
+            ef_search, filter_mode, space_type,
+        )
+    payload = paginate(payload, sort, search_after, pit_id, keep_alive)
+    payload = select_source(payload, source_includes, source_excludes)
+    return index, payload, search_params(search_pipeline, filter_path)
+
+
+@operation("search_combined")
+def search_combined(
+    query: str,
+    filters: dict = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    fts_score: float = 1.0,
+    neural_score: float = 1.0,
+    search_pipeline: str = None,
+    sort: list = None,
+    search_after: list = None,
+    pit_id: str = None,
+    keep_alive: str = "1m",
+    ef_search: int = None,
+    filter_mode: str = "pre",
+    space_type: str = "l2",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
+    """
+    Search for documents in the OpenSearch index using full text search and neural search
+
+    With a search_pipeline (see hybrid_pipeline) a native hybrid query is sent
+    and the pipeline's weights apply instead of fts_score and neural_score.
+    """
+    return search(
+        *prepare_search_combined(
+            query, filters, index, size, from_, model_id, k, fts_score, neural_score,
+            search_pipeline, sort, search_after, pit_id, keep_alive, ef_search,
+            filter_mode, space_type, source_includes, source_excludes, filter_path,
+        )
+    )
+
+
+SEARCH_TYPES = {
+    "query": prepare_search_query,
+    "neural": prepare_search_neural,
+    "combined": prepare_search_combined,
+}
+MSEARCH_CHUNK_SIZE = 100
+MSEARCH_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+
+SEARCH_TEMPLATES = {
+    "query": (
+        '{"query":{"bool":{"should":[{"match":{"content":{{#toJson}}query{{/toJson}}}}],'
+        '"filter":{{#toJson}}filters{{/toJson}}}},'
+        '"size":{{size}},"from":{{from}},"_source":{{#toJson}}source{{/toJson}}}'
+    ),
+    "neural": (
+        '{"query":{"bool":{"should":[{"neural":{"embedding":{'
+        '"query_text":{{#toJson}}query{{/toJson}},"model":{{#toJson}}model_id{{/toJson}},'
+        '{{#has_filters}}"filter":{"bool":{"filter":{{#toJson}}filters{{/toJson}}}},{{/has_filters}}'
+        '"k":{{k}}}}}]}},'
+        '"size":{{size}},"from":{{from}},"_source":{{#toJson}}source{{/toJson}}}'
+    ),
+    "combined": (
+        '{"query":{"bool":{"should":['
+        '{"script_score":{"query":{"match":{"content":{{#toJson}}query{{/toJson}}}},'
+        '"script":{"source":"' + WEIGHTED_SCORE_SCRIPT + '","params":{"weight":{{fts_score}}}}}},'
+        '{"script_score":{"query":{"neural":{"embedding":{'
+        '"query_text":{{#toJson}}query{{/toJson}},"model":{{#toJson}}model_id{{/toJson}},'
+        '{{#has_filters}}"filter":{"bool":{"filter":{{#toJson}}filters{{/toJson}}}},{{/has_filters}}'
+        '"k":{{k}}}}},'
+        '"script":{"source":"' + WEIGHTED_SCORE_SCRIPT + '","params":{"weight":{{neural_score}}}}}}],'
+        '"filter":{{#toJson}}filters{{/toJson}}}},'
+        '"size":{{size}},"from":{{from}},"_source":{{#toJson}}source{{/toJson}}}'
+    ),
+}
+SEARCH_TEMPLATE_PREFIX = "crud-ai-search-"
+
+
+def register_search_templates(prefix: str = SEARCH_TEMPLATE_PREFIX) -> dict:
+    """
+    Store the query, neural and combined search shapes as mustache search templates
+    """
+    return {
+        type: request(
+            "post",
+            f"_scripts/{prefix}{type}",
+            json={"script": {"lang": "mustache", "source": source}},
+        )
+        for type, source in SEARCH_TEMPLATES.items()
+    }
+
+
+def delete_search_templates(prefix: str = SEARCH_TEMPLATE_PREFIX) -> dict:
+    """
+    Delete the stored search templates
+    """
+    return {
+        type: request("delete", f"_scripts/{prefix}{type}")
+        for type in SEARCH_TEMPLATES
+    }
+
+
+def search_template_params(
+    query: str,
+    filters: list = None,
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    fts_score: float = 1.0,
+    neural_score: float = 1.0,
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+) -> dict:
+    """
+    Build the parameters of a stored search template
+    """
+    if isinstance(filters, dict):
+        filters = [filters]
+    return {
+        "query": query,
+        "filters": filters or [],
+        "has_filters": bool(filters),
+        "size": size,
+        "from": from_,
+        "model_id": model_id,
+        "k": k,
+        "fts_score": fts_score,
+        "neural_score": neural_score,
+        "source": select_source({}, source_includes, source_excludes).get("_source", True),
+    }
+
+
+@operation("search_template")
+def search_by_template(
+    type: str,
+    query: str,
+    filters: list = None,
+    index: str = "documents",
+    size: int = 10,
+    from_: int = 0,
+    model_id: str = None,
+    k: int = 10,
+    fts_score: float = 1.0,
+    neural_score: float = 1.0,
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+    prefix: str = SEARCH_TEMPLATE_PREFIX,
+):
+    """
+    Search with a stored template registered by register_search_templates, sending only its parameters
+
+    type is "query", "neural" or "combined". Filters apply inside the neural
+    clause, as with filter_mode "pre". The query vector cache does not apply.
+    """
+    return request(
+        "get",
+        f"{index}/_search/template",
+        params=search_params(filter_path=filter_path),
+        json={
+            "id": f"{prefix}{type}",
+            "params": search_template_params(
+                query, filters, size, from_, model_id, k, fts_score, neural_score,
+                source_includes, source_excludes,
+            ),
+        },
+    )
+
+
+def batch_query_vectors(searches: List[dict]) -> dict:
+    """
+    Embed the queries of a search batch with one predict call per model
+
+    Only the queries that would otherwise be embedded one by one while the
+    payloads are built are sent: neural and combined queries missing from
+    the query vector cache, and exact filtered ones when the cache is
+    disabled. The new vectors fill the cache and are returned keyed by
+    (model_id, normalized query).
+    """
+    missing = {}
+    for spec in searches:
+        model_id = spec.get("model_id")
+        if spec.get("type", "query") == "query" or not model_id:
+            continue
+        if _query_vectors is None and spec.get("filter_mode", "pre") != "exact":
+            continue
+        key = (model_id, normalize_query(spec["query"]))
+        if _query_vectors is None or _query_vectors.get(key) is None:
+            missing.setdefault(model_id, {})[key[1]] = None
+
+    vectors = {}
+    for model_id, queries in missing.items():
+        queries = list(queries)
+        for query, vector in zip(queries, predict_text_embedding(model_id, queries)):
+            vectors[(model_id, query)] = vector
+            if _query_vectors is not None:
+                _query_vectors.set((model_id, query), vector)
+    return vectors
+
+
+def msearch_params(params: dict = None) -> dict:
+    """
+    Adapt search query parameters to _msearch, scoping filter_path to each response
+    """
+    if not params or "filter_path" not in params:
+        return params
+
+    paths = [f"responses.{path}" for path in params["filter_path"].split(",")]
+    return {
+        **params,
+        "filter_path": ",".join(paths + ["responses.error", "responses.status"]),
+    }
+
+
+@operation("search_batch")
+def search_batch(
+    searches: List[dict],
+    chunk_size: int = MSEARCH_CHUNK_SIZE,
+    max_chunk_bytes: int = MSEARCH_MAX_CHUNK_BYTES,
+) -> list:
+    """
+    Run many searches through _msearch, returning responses in input order
+
+    Each search is a dict of search_query, search_neural or search_combined
+    arguments with a "type" of "query" (default), "neural" or "combined".
+    Failed searches come back as {"error": ..., "status": ...} in their slot.
+    Query embeddings are computed up front (see batch_query_vectors).
+    """
+    results = [None] * len(searches)
+    groups = {}
+    vectors = batch_query_vectors(searches)
+
+    for position, spec in enumerate(searches):
+        spec = dict(spec)
+        prepare = SEARCH_TYPES[spec.pop("type", "query")]
+        vector = vectors.get((spec.get("model_id"), normalize_query(spec["query"])))
+        if vector is not None:
+            spec.setdefault("vector", vector)
+        index, payload, params = prepare(**spec)
+        key = search_cache_key(index, payload, params)
+        cacheable = _search_results is not None and "pit" not in payload
+
+        if cacheable:
+            cached = _search_results.get(key)
+            if cached is not None:
+                results[position] = codec.loads(cached)
+                continue
+
+        header = {} if "pit" in payload else {"index": index}
+        params = msearch_params(params)
+        group = groups.setdefault(codec.dumps(params or {}, sort_keys=True), (params, []))
+        cache = (key, search_cache_generation(index)) if cacheable else None
+        group[1].append((position, cache, header, payload))
+
+    for params, pending in groups.values():
+        remaining = iter(pending)
+        for count, body in _ndjson_bodies(
+            ((header, payload) for _, _, header, payload in pending),
+            chunk_size,
+            max_chunk_bytes,
+        ):
+            chunk = [next(remaining) for _ in range(count)]
+            response = request(
+                "post",
+                "_msearch",
+                params=params,
+                data=body,
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+            responses = response.get("responses") or [
+                {"error": response.get("error", response)}
+            ] * count
+
+            for (position, cache, _, _), result in zip(chunk, responses):
+                results[position] = result
+                if cache is not None:
+                    store_search_result(*cache, result)
+
+    return results
+
+
+def create_pit(index: str, keep_alive: str = "1m"):
+    """
+    Create a point in time on an index
+    """
+    return request(
+        "post",
+        f"{index}/_search/point_in_time",
+        params={"keep_alive": keep_alive},
+    )
+
+
+def delete_pit(pit_id: str):
+    """
+    Delete a point in time
+    """
+    return request(
+        "delete",
+        "_search/point_in_time",
+        json={"pit_id": [pit_id]},
+    )
+
+
+def scan_documents(
+    index: str = "documents",
+    query: dict = None,
+    size: int = 1000,
+    sort: list = None,
+    keep_alive: str = "1m",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+) -> Iterator[dict]:
+    """
+    Lazily yield every hit matching a query, page by page, from a point in time
+
+    The point in time is closed when the iterator is exhausted, fails or is closed.
+    """
+    pit_id = create_pit(index, keep_alive)["pit_id"]
+    try:
+        search_after = None
+        while True:
+            payload = paginate(
+                {"query": query or {"match_all": {}}, "size": size},
+                sort or [{"_doc": "asc"}],
+                search_after,
+                pit_id,
+                keep_alive,
+            )
+            payload = select_source(payload, source_includes, source_excludes)
+            response = request("get", "_search", json=payload)
+            if "error" in response:
+                raise Exception(f"Scan failed: {response['error']}")
+
+            hits = response["hits"]["hits"]
+            yield from hits
+
+            if len(hits) < size:
+                return
+            search_after = hits[-1]["sort"]
+            pit_id = response.get("pit_id", pit_id)
+    finally:
+        delete_pit(pit_id)
+
+
+def document_params(
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+) -> dict:
+    """
+    Build the _source filtering and filter_path query parameters of a document request
+    """
+    params = {}
+    if source_includes:
+        params["_source_includes"] = ",".join(source_includes)
+    if source_excludes:
+        params["_source_excludes"] = ",".join(source_excludes)
+    if filter_path:
+        params["filter_path"] = filter_path
+    return params
 
 
-def get_document(id: str, index: str = "documents"):
+@operation("get_document")
+def get_document(
+    id: str,
+    index: str = "documents",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    filter_path: str = None,
+):
     """
     Get a document from the OpenSearch index
     """
-    return request("get", f"{index}/_doc/{id}")
+    return request(
+        "get",
+        f"{index}/_doc/{id}",
+        params=document_params(source_includes, source_excludes, filter_path),
+    )
+
+
+MGET_CHUNK_SIZE = 1000
+
+
+@operation("get_documents")
+def get_documents(
+    ids: Iterable[str],
+    index: str = "documents",
+    source_includes: list = None,
+    source_excludes: list = DEFAULT_SOURCE_EXCLUDES,
+    chunk_size: int = MGET_CHUNK_SIZE,
+) -> list:
+    """
+    Get many documents through the _mget API in chunks, in the order of ids
+
+    Missing documents come back with "found": false in their slot.
+    """
+    ids = list(ids)
+    params = document_params(source_includes, source_excludes)
+    docs = []
+    for start in range(0, len(ids), chunk_size):
+        response = request(
+            "post",
+            f"{index}/_mget",
+            params=params,
+            json={"ids": ids[start:start + chunk_size]},
+        )
+        if "docs" not in response:
+            raise Exception(f"Multi-get failed: {response.get('error', response)}")
+        docs.extend(response["docs"])
+    return docs
+
+
+def document_source(
+    content: str,
+    content_type: str = "text/plain",
+    meta: dict = None,
+    embedding: list = None,
+) -> dict:
+    """
+    Build the indexed source of a document, with a precomputed embedding if given
+    """
+    source = {
+        "content": content,
+        "content_type": content_type,
+        "meta": meta or {},
+    }
+    if embedding is not None:
+        source["embedding"] = embedding
+    return source
 
 
+@operation("index_document")
 def index_document(
     id: str,
     content: str,
@@ -153,6 +1165,7 @@ def index_document(
     meta: dict = None,
     index: str = "documents",
     pipeline: str = None,
+    embedding: list = None,
 ):
     """
     Index a document in the OpenSearch index
@@ -160,23 +1173,209 @@ def index_document(
     params = {}
     if pipeline:
         params["pipeline"] = pipeline
-    return request(
+    response = request(
         "put",
         f"{index}/_doc/{id}",
         params=params,
-        json={
-            "content": content,
-            "content_type": content_type,
-            "meta": meta or {},
-        },
+        json=document_source(content, content_type, meta, embedding),
     )
+    invalidate_search_cache(index)
+    return response
 
 
+@operation("delete_document")
 def delete_document(id: str, index: str = "documents"):
     """
     Delete a document from the OpenSearch index
     """
-    return request("delete", f"{index}/_doc/{id}")
+    response = request("delete", f"{index}/_doc/{id}")
+    invalidate_search_cache(index)
+    return response
+
+
+BULK_CHUNK_SIZE = 500
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+
+def _ndjson_bodies(
+    actions: Iterable[Tuple[dict, dict]],
+    chunk_size: int,
+    max_chunk_bytes: int,
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    Serialize (header, body) pairs into NDJSON bodies bounded by pair count and bytes
+    """
+    lines, count, size = [], 0, 0
+    for action, source in actions:
+        entry = codec.dumps(action) + b"\n"
+        if source is not None:
+            entry += codec.dumps(source) + b"\n"
+        if count and (count >= chunk_size or size + len(entry) > max_chunk_bytes):
+            yield count, b"".join(lines)
+            lines, count, size = [], 0, 0
+        lines.append(entry)
+        count += 1
+        size += len(entry)
+    if count:
+        yield count, b"".join(lines)
+
+
+@operation("bulk")
+def bulk(
+    actions: Iterable[Tuple[dict, dict]],
+    index: str = None,
+    pipeline: str = None,
+    refresh: str = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+):
+    """
+    Send (action, source) pairs to the _bulk API in chunks, collecting per-item failures
+    """
+    params = {}
+    if pipeline:
+        params["pipeline"] = pipeline
+    if refresh:
+        params["refresh"] = refresh
+
+    path = f"{index}/_bulk" if index else "_bulk"
+    summary = {"took": 0, "bytes": 0, "succeeded": 0, "failed": 0, "errors": []}
+    touched = {index} if index else set()
+    ids = []
+
+    def track(actions):
+        for action, source in actions:
+            meta = next(iter(action.values()))
+            if meta.get("_index"):
+                touched.add(meta["_index"])
+            ids.append(None if meta.get("_id") is None else str(meta["_id"]))
+            yield action, source
+
+    for count, body in _ndjson_bodies(track(actions), chunk_size, max_chunk_bytes):
+        chunk_ids = ids[:count]
+        del ids[:count]
+        summary["bytes"] += len(body)
+        response = request(
+            "post",
+            path,
+            params=params,
+            data=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+        if "items" not in response:
+            summary["failed"] += count
+            summary["errors"].append(
+                {
+                    "count": count,
+                    "_ids": chunk_ids,
+                    "status": response.get("status"),
+                    "error": response.get("error", response),
+                }
+            )
+            continue
+
+        summary["took"] += response.get("took", 0)
+        for item in response["items"]:
+            op, result = next(iter(item.items()))
+            if "error" in result:
+                summary["failed"] += 1
+                summary["errors"].append(
+                    {
+                        "op": op,
+                        "_id": result.get("_id"),
+                        "status": result.get("status"),
+                        "error": result["error"],
+                    }
+                )
+            else:
+                summary["succeeded"] += 1
+
+        for name in touched:
+            invalidate_search_cache(name)
+
+    return summary
+
+
+def bulk_index_documents(
+    documents: Iterable[dict],
+    index: str = "documents",
+    pipeline: str = None,
+    refresh: str = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+):
+    """
+    Index documents in the OpenSearch index through the _bulk API
+    """
+    actions = (
+        (
+            {"index": {"_id": document["id"]}},
+            document_source(
+                document["content"],
+                document.get("content_type", "text/plain"),
+                document.get("meta"),
+                document.get("embedding"),
+            ),
+        )
+        for document in documents
+    )
+    return bulk(
+        actions,
+        index=index,
+        pipeline=pipeline,
+        refresh=refresh,
+        chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes,
+    )
+
+
+def delete_documents(
+    ids: Iterable[str],
+    index: str = "documents",
+    refresh: str = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+):
+    """
+    Delete many documents from the OpenSearch index through the _bulk API
+    """
+    return bulk(
+        (({"delete": {"_id": id}}, None) for id in ids),
+        index=index,
+        refresh=refresh,
+        chunk_size=chunk_size,
+    )
+
+
+@operation("delete_by_query")
+def delete_by_query(
+    filters: list,
+    index: str = "documents",
+    slices: str = "auto",
+    conflicts: str = "proceed",
+    refresh: bool = True,
+    wait_for_completion: bool = True,
+):
+    """
+    Delete every document matching filters, sliced across shards in parallel
+
+    Without wait_for_completion the response holds a task id to poll through
+    the tasks API instead of the deletion counts, and search results for the
+    index are not cached until refresh_index is called after the task.
+    """
+    response = request(
+        "post",
+        f"{index}/_delete_by_query",
+        params={
+            "slices": slices,
+            "conflicts": conflicts,
+            "refresh": str(refresh).lower(),
+            "wait_for_completion": str(wait_for_completion).lower(),
+        },
+        json={"query": {"bool": {"filter": filters}}},
+    )
+    invalidate_search_cache(index, pending=not wait_for_completion)
+    return response
 
 
 def embedding_pipeline(id: str, model_id: str):
@@ -202,6 +1401,47 @@ def embedding_pipeline(id: str, model_id: str):
     )
 
 
+def hybrid_pipeline(
+    id: str,
+    normalization: str = "min_max",
+    combination: str = "arithmetic_mean",
+    fts_score: float = 0.5,
+    neural_score: float = 0.5,
+):
+    """
+    Create a search pipeline that normalizes and blends hybrid query scores
+    """
+    return request(
+        "put",
+        f"_search/pipeline/{id}",
+        json={
+            "description": "Blend full text and neural scores",
+            "phase_results_processors": [
+                {
+                    "normalization-processor": {
+                        "normalization": {
+                            "technique": normalization,
+                        },
+                        "combination": {
+                            "technique": combination,
+                            "parameters": {
+                                "weights": [fts_score, neural_score],
+                            },
+                        },
+                    },
+                },
+            ],
+        },
+    )
+
+
+def delete_search_pipeline(id: str):
+    """
+    Delete a search pipeline from the OpenSearch service
+    """
+    return request("delete", f"_search/pipeline/{id}")
+
+
 def delete_pipeline(id: str):
     """
     Delete a pipeline from the OpenSearch service
@@ -209,46 +1449,147 @@ def delete_pipeline(id: str):
     return request("delete", f"_ingest/pipeline/{id}")
 
 
+MODEL_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+
+def model_dimension(model: str = OPENAI_EMBEDDING_MODEL) -> int:
+    """
+    Get the vector dimension produced by an embedding model
+    """
+    if model not in MODEL_DIMENSIONS:
+        raise ValueError(f"Unknown embedding model dimension: {model}")
+    return MODEL_DIMENSIONS[model]
+
+
+def pq_sub_vectors(dimension: int) -> int:
+    """
+    Default number of PQ sub-vectors for a dimension, one per 8 values
+    """
+    return max(1, dimension // 8)
+
+
+def vector_method(
+    name: str = "hnsw",
+    space_type: str = "l2",
+    engine: str = "lucene",
+    parameters: dict = None,
+    encoder: str = None,
+    pq_m: int = None,
+    pq_code_size: int = 8,
+    m: int = None,
+    ef_construction: int = None,
+) -> dict:
+    """
+    Build a k-NN method definition
+
+    m and ef_construction set the HNSW graph degree and build-time beam width.
+
+    encoder is "fp16" for faiss scalar quantization or "pq" for faiss product
+    quantization. PQ methods need pq_m (see pq_sub_vectors) and must be
+    trained with train_knn_model before use.
+    """
+    parameters = dict(parameters or {})
+    if m:
+        parameters["m"] = m
+    if ef_construction:
+        parameters["ef_construction"] = ef_construction
+
+    if encoder == "fp16":
+        parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+    elif encoder == "pq":
+        if not pq_m:
+            raise ValueError("The pq encoder needs pq_m sub-vectors")
+        parameters["encoder"] = {
+            "name": "pq",
+            "parameters": {"m": pq_m, "code_size": pq_code_size},
+        }
+    elif encoder:
+        raise ValueError(f"Unknown vector encoder: {encoder}")
+
+    if encoder and engine != "faiss":
+        raise ValueError(f"The {encoder} encoder needs the faiss engine, not {engine}")
+
+    return {
+        "name": name,
+        "engine": engine,
+        "space_type": space_type,
+        "parameters": parameters,
+    }
+
+
 def embedding_template(
     id: str,
     default_pipeline: str,
-    dimension: int = 768,
+    dimension: int = None,
     name: str = "hnsw",
     space_type: str = "l2",
     engine: str = "lucene",
     parameters: dict = None,
     index_patterns: list = ["documents*"],
+    number_of_shards: int = 1,
+    number_of_replicas: int = 0,
+    encoder: str = None,
+    data_type: str = None,
+    knn_model_id: str = None,
+    m: int = None,
+    ef_construction: int = None,
+    ef_search: int = None,
+    pq_m: int = None,
+    pq_code_size: int = 8,
 ):
     """
     Update or create an index template in the OpenSearch service
+
+    The dimension defaults to that of the configured embedding model. Vectors
+    can be stored compactly with encoder "fp16" (see vector_method), data_type
+    "byte", or a PQ model trained with train_knn_model and given as
+    knn_model_id; an untrained encoder "pq" is rejected. m, ef_construction and
+    ef_search tune HNSW; ef_search here is the index default for the faiss
+    and nmslib engines. Use estimate_shards to size number_of_shards from the
+    expected corpus.
     """
-    parameters = parameters or {}
+    if encoder == "pq" and not knn_model_id:
+        raise ValueError("The pq encoder needs a model trained with train_knn_model, given as knn_model_id")
+
+    if knn_model_id:
+        embedding = {"type": "knn_vector", "model_id": knn_model_id}
+    else:
+        embedding = {
+            "type": "knn_vector",
+            "dimension": dimension or model_dimension(),
+            "method": vector_method(
+                name, space_type, engine, parameters, encoder,
+                pq_m=pq_m, pq_code_size=pq_code_size,
+                m=m, ef_construction=ef_construction,
+            ),
+        }
+        if data_type:
+            embedding["data_type"] = data_type
+
+    settings = {
+        "default_pipeline": default_pipeline,
+        "index.knn": True,
+        "number_of_shards": number_of_shards,
+        "number_of_replicas": number_of_replicas,
+    }
+    if ef_search:
+        settings["index.knn.algo_param.ef_search"] = ef_search
 
     return request(
         "put",
         f"_template/{id}",
         json={
             "index_patterns": index_patterns,
-            "settings": {
-                "default_pipeline": default_pipeline,
-                "index.knn": True,
-                "number_of_shards": 1,
-                "number_of_replicas": 0,
-            },
+            "settings": settings,
             "mappings": {
                 "properties": {
                     "content": {"type": "text"},
                     "content_type": {"type": "keyword"},
-                    "embedding": {
-                        "type": "knn_vector",
-                        "dimension": dimension,
-                        "method": {
-                            "name": name,
-                            "engine": engine,
-                            "space_type": space_type,
-                            "parameters": parameters,
-                        },
-                    },
+                    "embedding": embedding,
                     "meta": {"type": "object"},
                     "title": {"type": "text"},
                 }
@@ -257,6 +1598,72 @@ def embedding_template(
     )
 
 
+def train_knn_model(
+    id: str,
+    training_index: str,
+    method: dict,
+    dimension: int = None,
+    training_field: str = "embedding",
+    max_training_vector_count: int = None,
+):
+    """
+    Train a k-NN model, such as a faiss PQ method, from vectors already in an index
+    """
+    payload = {
+        "training_index": training_index,
+        "training_field": training_field,
+        "dimension": dimension or model_dimension(),
+        "method": method,
+    }
+    if max_training_vector_count:
+        payload["max_training_vector_count"] = max_training_vector_count
+    return request("post", f"_plugins/_knn/models/{id}/_train", json=payload)
+
+
+def estimate_vector_memory(
+    dimension: int = None,
+    vectors: int = 1_000_000,
+    m: int = 16,
+    encoder: str = None,
+    data_type: str = "float",
+    pq_m: int = None,
+    pq_code_size: int = 8,
+    segments: int = 1,
+) -> int:
+    """
+    Estimate native HNSW memory in bytes for a number of vectors
+
+    Follows the k-NN plugin sizing formulas, including their 10% overhead.
+    """
+    dimension = dimension or model_dimension()
+
+    if encoder == "pq":
+        pq_m = pq_m or pq_sub_vectors(dimension)
+        per_vector = (pq_code_size / 8) * pq_m + 24 + 8 * m
+        codebooks = segments * (2 ** pq_code_size) * 4 * dimension
+        return int(1.1 * (per_vector * vectors + codebooks))
+
+    if encoder == "fp16":
+        bytes_per_value = 2
+    elif data_type == "byte":
+        bytes_per_value = 1
+    else:
+        bytes_per_value = 4
+
+    return int(1.1 * (bytes_per_value * dimension + 8 * m) * vectors)
+
+
+def estimate_shards(
+    documents: int,
+    document_bytes: int = 16 * 1024,
+    shard_bytes: int = 30 * 1024 ** 3,
+) -> int:
+    """
+    Estimate a primary shard count keeping shards under shard_bytes for the expected corpus
+    """
+    return max(1, math.ceil(documents * document_bytes / shard_bytes))
+
+
 def delete_index_template(id: str):
     """
     Delete an index template from the OpenSearch service
@@ -264,24 +1671,70 @@ def delete_index_template(id: str):
     return request("delete", f"_index_template/{id}")
 
 
-def ml_task(task: dict):
+ML_TASK_DONE_STATES = {"COMPLETED", "COMPLETED_WITH_ERROR", "FAILED", "CANCELLED"}
+ML_TASK_TIMEOUT = 60.0
+
+
+def wait_until(check, timeout: float = ML_TASK_TIMEOUT, description: str = "condition"):
     """
-    Handle a task from the OpenSearch ML service
+    Call check with jittered exponential backoff until it returns something other than None
     """
-    if task['status'] == 'COMPLETED':
-        return task
+    deadline = time.monotonic() + timeout
+    for delay in delays():
+        result = check()
+        if result is not None:
+            return result
 
-    task_id = task["task_id"]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Timed out after {timeout}s waiting for {description}")
+        time.sleep(min(delay, remaining))
 
-    while True:
-        task = request("get", f"_plugins/_ml/tasks/{task_id}")
 
-        if task["state"] in ["COMPLETED", "FAILED", "CREATED"]:
+@operation("ml_task")
+def wait_for_task(task_id: str, timeout: float = ML_TASK_TIMEOUT) -> dict:
+    """
+    Wait for an ML task to reach a final state
+
+    CREATED, RUNNING and any other in-between states keep waiting until the deadline.
+    """
+    def check():
+        task = request("get", f"_plugins/_ml/tasks/{task_id}")
+        if task.get("state") in ML_TASK_DONE_STATES or "error" in task:
             return task
+        return None
+
+    return wait_until(check, timeout, f"ML task {task_id}")
+
+
+def wait_for_tasks(task_ids: List[str], timeout: float = ML_TASK_TIMEOUT) -> dict:
+    """
+    Wait for many ML tasks concurrently, returning final tasks by id
+
+    At most one thread per pooled connection polls at a time.
+    """
+    if not task_ids:
+        return {}
+
+    with ThreadPoolExecutor(min(len(task_ids), get_transport().pool_size)) as executor:
+        futures = {
+            task_id: executor.submit(wait_for_task, task_id, timeout)
+            for task_id in task_ids
+        }
+        return {task_id: future.result() for task_id, future in futures.items()}
+
+
+def ml_task(task: dict, timeout: float = ML_TASK_TIMEOUT):
+    """
+    Handle a task from the OpenSearch ML service, waiting for it to finish
+    """
+    if task.get("status") == "COMPLETED" or "task_id" not in task:
+        return task
 
-        raise Exception(f"Unknown task state: {task}")
+    return wait_for_task(task["task_id"], timeout)
 
 
+@operation("upload_model")
 def upload_model(
     name: str, version: str, model_format: str, model_config: dict, url: str
 ):
@@ -303,6 +1756,7 @@ def upload_model(
     )
 
 
+@operation("load_model")
 def load_model(model_id: str):
     """
     Load a model in the OpenSearch service
@@ -315,6 +1769,7 @@ def load_model(model_id: str):
     )
 
 
+@operation("unload_model")
 def unload_model(model_id: str):
     """
     Unload a model from the OpenSearch service
@@ -325,7 +1780,7 @@ def unload_model(model_id: str):
     )
 
 
-def search_connectors(name: str = None):
+def search_connectors(name: str = None, size: int = 10):
     """
     Search for connectors in the OpenSearch service
     """
@@ -345,11 +1800,12 @@ def search_connectors(name: str = None):
         "_plugins/_ml/connectors/_search",
         json={
             "query": query,
+            "size": size,
         }
     )
 
 
-def create_openai_connector(name: str, api_key: str, organization_id: str = None, model: str = 'text-embedding-3-small'):
+def create_openai_connector(name: str, api_key: str, organization_id: str = None, model: str = OPENAI_EMBEDDING_MODEL):
     """
     Create an OpenAI connector in the OpenSearch service
     """
@@ -455,7 +1911,7 @@ def register_model_group(name: str, description: str):
     )
 
 
-def search_model_groups(name: str = None):
+def search_model_groups(name: str = None, size: int = 10):
     """
     Search for model groups in the OpenSearch service
     """
@@ -475,6 +1931,7 @@ def search_model_groups(name: str = None):
         "_plugins/_ml/model_groups/_search",
         json={
             "query": query,
+            "size": size,
         }
     )
 
@@ -489,6 +1946,7 @@ def delete_model_group(id: str):
     )
 
 
+@operation("register_model")
 def register_model(name: str, description: str, model_group_id: str, connector_id: str):
     """
     Register a model in the OpenSearch service
@@ -506,16 +1964,18 @@ def register_model(name: str, description: str, model_group_id: str, connector_i
     ))
 
 
+@operation("deploy_model")
 def deploy_model(model_id: str):
     """
     Deploy a model in the OpenSearch service
     """
-    return request(
+    return ml_task(request(
         "post",
         f"_plugins/_ml/models/{model_id}/_deploy",
-    )
+    ))
 
 
+@operation("undeploy_model")
 def undeploy_model(model_id: str):
     """
     Undeploy a model from the OpenSearch service
@@ -526,7 +1986,7 @@ def undeploy_model(model_id: str):
     )
 
 
-def search_models():
+def search_models(size: int = 10):
     """
     Search for models in the OpenSearch service
     """
@@ -536,11 +1996,13 @@ def search_models():
         json={
             "query": {
                 "match_all": {},
-            }
+            },
+            "size": size,
         }
     )
 
 
+@operation("delete_model")
 def delete_model(id: str):
     """
     Delete a model from the OpenSearch service
@@ -555,4 +2017,180 @@ def delete_index(index: str):
     """
     Delete an index from the OpenSearch service
     """
-    return request("delete", index)
+    response = request("delete", index)
+    invalidate_search_cache(index)
+    return response
+
+
+def create_index(index: str, body: dict = None):
+    """
+    Create an index in the OpenSearch service
+    """
+    return request("put", index, json=body or {})
+
+
+def get_index_settings(index: str, names: str = None):
+    """
+    Get the settings of one or more indices
+    """
+    path = f"{index}/_settings/{names}" if names else f"{index}/_settings"
+    return request("get", path)
+
+
+def update_index_settings(index: str, settings: dict):
+    """
+    Update the dynamic settings of one or more indices
+
+    Cached search results are dropped, since settings such as
+    refresh_interval change what searches can see.
+    """
+    response = request("put", f"{index}/_settings", json={"index": settings})
+    invalidate_search_cache(index)
+    return response
+
+
+def refresh_index(index: str):
+    """
+    Refresh one or more indices, dropping their cached search results
+    """
+    response = request("post", f"{index}/_refresh")
+    invalidate_search_cache(index)
+    return response
+
+
+def force_merge(index: str, max_num_segments: int = 1):
+    """
+    Force merge one or more indices down to max_num_segments segments
+    """
+    return request(
+        "post",
+        f"{index}/_forcemerge",
+        params={"max_num_segments": max_num_segments},
+        timeout=None,
+    )
+
+
+REINDEX_TIMEOUT = 24 * 3600.0
+
+
+def reindex(
+    source: str,
+    dest: str,
+    pipeline: str = None,
+    slices: str = "auto",
+    requests_per_second: float = None,
+    wait_for_completion: bool = False,
+):
+    """
+    Copy documents between indices with _reindex, sliced in parallel
+
+    With pipeline "_none" the destination's default pipeline is skipped, so
+    stored embeddings are copied instead of recomputed. Without
+    wait_for_completion the response holds a task id for wait_for_reindex,
+    and search results for dest are not cached until refresh_index.
+    """
+    destination = {"index": dest}
+    if pipeline:
+        destination["pipeline"] = pipeline
+    params = {
+        "slices": slices,
+        "wait_for_completion": str(wait_for_completion).lower(),
+    }
+    if requests_per_second:
+        params["requests_per_second"] = requests_per_second
+    response = request(
+        "post",
+        "_reindex",
+        params=params,
+        json={"source": {"index": source}, "dest": destination},
+        timeout=None,
+    )
+    invalidate_search_cache(dest, pending=not wait_for_completion)
+    return response
+
+
+def get_task(task_id: str):
+    """
+    Get the status of a task from the tasks API
+    """
+    return request("get", f"_tasks/{task_id}")
+
+
+@operation("reindex_task")
+def wait_for_reindex(task_id: str, timeout: float = REINDEX_TIMEOUT, progress=None) -> dict:
+    """
+    Wait for a reindex task to complete, passing each status to progress
+    """
+    def check():
+        task = get_task(task_id)
+        if "error" in task or task.get("completed"):
+            return task
+        if progress:
+            progress(task["task"])
+        return None
+
+    return wait_until(check, timeout, f"reindex task {task_id}")
+
+
+def get_alias(name: str) -> list:
+    """
+    Get the indices behind an alias
+    """
+    response = request("get", f"_alias/{name}")
+    if response.get("status") == 404:
+        return []
+    return sorted(index for index in response if index not in ("error", "status"))
+
+
+def update_aliases(actions: list):
+    """
+    Apply add, remove and remove_index alias actions atomically
+    """
+    response = request("post", "_aliases", json={"actions": actions})
+    for action in actions:
+        options = next(iter(action.values()))
+        for name in (options.get("alias"), options.get("index")):
+            if name:
+                invalidate_search_cache(name)
+    return response
+
+
+BULK_LOAD_SETTINGS = ("refresh_interval", "number_of_replicas")
+
+
+@contextmanager
+def bulk_load(index: str, max_num_segments: int = None):
+    """
+    Disable refreshes and replicas on an index for the duration of a bulk load
+
+    The original settings are restored even if the load fails. After a
+    successful load the index is refreshed and, with max_num_segments,
+    force merged.
+    """
+    response = get_index_settings(index)
+    if response.get("status") == 404 and "*" not in index:
+        create_index(index)
+        response = get_index_settings(index)
+    if "error" in response:
+        raise Exception(f"Could not read settings of {index}: {response['error']}")
+
+    original = {
+        name: {
+            setting: settings["settings"]["index"].get(setting)
+            for setting in BULK_LOAD_SETTINGS
+        }
+        for name, settings in response.items()
+    }
+
+    for name in original:
+        update_index_settings(name, {"refresh_interval": "-1", "number_of_replicas": 0})
+
+    try:
+        yield original
+    finally:
+        for name, settings in original.items():
+            update_index_settings(name, settings)
+
+    refresh_index(index)
+    if max_num_segments:
+        force_merge(index, max_num_segments)
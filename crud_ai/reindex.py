@@ -0,0 +1,106 @@
+"""
+Zero-downtime blue/green reindexing behind an alias
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from crud_ai.opensearch import (
+    REINDEX_TIMEOUT,
+    bulk_load,
+    create_index,
+    delete_index,
+    get_alias,
+    get_index_settings,
+    reindex,
+    update_aliases,
+    wait_for_reindex,
+)
+
+
+def versioned_index(alias: str, version: str = None) -> str:
+    """
+    Name a new index for an alias, versioned by UTC timestamp by default
+    """
+    return f"{alias}-{version or datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+
+
+def blue_green(
+    alias: str = "documents",
+    version: str = None,
+    skip_pipeline: bool = False,
+    slices: str = "auto",
+    requests_per_second: float = None,
+    delete_old: bool = False,
+    timeout: float = REINDEX_TIMEOUT,
+    progress: Callable[[dict], None] = None,
+) -> dict:
+    """
+    Copy the index behind an alias into a new versioned index and swap the alias to it
+
+    The new index picks up the current index template. The copy runs as a
+    sliced _reindex task with refreshes and replicas disabled, while
+    searches keep hitting the old index through the alias. The alias then
+    moves in one atomic _aliases call. If the alias is still a concrete
+    index (the first migration), that index is replaced by the alias in the
+    same call. With skip_pipeline, stored embeddings are copied as they are
+    instead of being recomputed by the ingest pipeline. Writes made during
+    the copy are not carried over; run sync afterwards to pick them up.
+    """
+    started = time.perf_counter()
+    current = get_alias(alias)
+    concrete = not current and get_index_settings(alias).get("status") != 404
+    source = ",".join(current) if current else alias
+    if not current and not concrete:
+        raise Exception(f"Nothing to reindex: {alias} is neither an alias nor an index")
+
+    dest = versioned_index(alias, version)
+    response = create_index(dest)
+    if "error" in response:
+        raise Exception(f"Could not create {dest}: {response['error']}")
+
+    try:
+        with bulk_load(dest):
+            response = reindex(
+                source,
+                dest,
+                pipeline="_none" if skip_pipeline else None,
+                slices=slices,
+                requests_per_second=requests_per_second,
+            )
+            if "task" not in response:
+                raise Exception(f"Reindex failed: {response.get('error', response)}")
+            task = wait_for_reindex(response["task"], timeout, progress)
+
+        result = task.get("response", {})
+        if "error" in task or result.get("failures"):
+            raise Exception(f"Reindex failed: {task.get('error') or result['failures']}")
+    except Exception:
+        delete_index(dest)
+        raise
+
+    if concrete:
+        actions = [{"remove_index": {"index": alias}}]
+    else:
+        actions = [{"remove": {"index": index, "alias": alias}} for index in current]
+    actions.append({"add": {"index": dest, "alias": alias}})
+
+    response = update_aliases(actions)
+    if not response.get("acknowledged"):
+        delete_index(dest)
+        raise Exception(f"Alias swap failed: {response.get('error', response)}")
+
+    if delete_old and current:
+        delete_index(",".join(current))
+
+    return {
+        "alias": alias,
+        "source": source,
+        "dest": dest,
+        "total": result.get("total", 0),
+        "created": result.get("created", 0),
+        "took": result.get("took", 0),
+        "deleted_old": concrete or bool(delete_old and current),
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
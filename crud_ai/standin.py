@@ -0,0 +1,1021 @@
+"""
+Local stand-in for the OpenSearch and OpenAI embeddings endpoints used by crud_ai
+
+It keeps everything in memory and implements enough of each API for the
+helpers in crud_ai.opensearch and for benchmarks: documents, _bulk,
+_search/_msearch (match, term(s), ids, bool, knn, neural, script_score and
+hybrid queries), point in time, ingest and search pipelines, templates,
+stored search templates and the ML plugin endpoints. Embeddings are
+deterministic hashed bag-of-words vectors, so texts sharing words are close.
+Latency can be injected per request, per embedding call and per bulk item,
+and a bounded bulk queue rejects excess concurrent _bulk requests with 429s.
+Gzip request bodies are accepted, responses are gzipped for clients that
+accept it, and a bandwidth cap makes transfer time proportional to wire size.
+"""
+
+import gzip
+import hashlib
+import itertools
+import math
+import re
+import threading
+import time
+import uuid
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from crud_ai import codec
+
+TOKEN = re.compile(r"\w+")
+
+
+class StandinError(Exception):
+    """
+    An error to return as an OpenSearch style error response
+    """
+
+    def __init__(self, status: int, type: str, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.type = type
+        self.reason = reason
+
+
+def tokens(text) -> list:
+    return TOKEN.findall(str(text).lower())
+
+
+def field_value(source: dict, field: str):
+    value = source
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def l2_score(a: list, b: list) -> float:
+    return 1 / (1 + sum((x - y) ** 2 for x, y in zip(a, b)))
+
+
+class Standin:
+    """
+    In-memory OpenSearch and embeddings state
+    """
+
+    def __init__(
+        self,
+        dimension: int = 64,
+        latency: float = 0.0,
+        embedding_latency: float = 0.0,
+        item_latency: float = 0.0,
+        bulk_queue: int = 0,
+        bandwidth: float = 0.0,
+        compression: bool = True,
+    ):
+        self.dimension = dimension
+        self.latency = latency
+        self.embedding_latency = embedding_latency
+        self.item_latency = item_latency
+        self.bulk_queue = bulk_queue
+        self.bandwidth = bandwidth
+        self.compression = compression
+        self.bulk_active = 0
+        self.bulk_lock = threading.Lock()
+        self.lock = threading.RLock()
+        self.indices = {}
+        self.aliases = {}
+        self.tasks = {}
+        self.templates = {}
+        self.pipelines = {}
+        self.search_pipelines = {}
+        self.scripts = {}
+        self.pits = {}
+        self.ml = {"models": {}, "model_groups": {}, "connectors": {}, "tasks": {}}
+        self.sequence = itertools.count()
+        self.embedding_calls = 0
+
+    # Embeddings
+
+    def embed(self, texts: list) -> list:
+        """
+        Embed texts as normalized hashed bag-of-words vectors
+        """
+        self.embedding_calls += 1
+        if self.embedding_latency:
+            time.sleep(self.embedding_latency)
+
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dimension
+            for token in tokens(text):
+                digest = hashlib.md5(token.encode()).digest()
+                vector[int.from_bytes(digest[:4], "little") % self.dimension] += (
+                    1.0 if digest[4] & 1 else -1.0
+                )
+            norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+            vectors.append([value / norm for value in vector])
+        return vectors
+
+    # Indices
+
+    def create_index(self, name: str, body: dict = None) -> dict:
+        body = body or {}
+        settings, mappings = {}, {}
+        for template in self.templates.values():
+            if any(fnmatch(name, pattern) for pattern in template.get("index_patterns", [])):
+                settings.update(template.get("settings", {}))
+                mappings.update(template.get("mappings", {}))
+        settings.update(body.get("settings", {}))
+        mappings.update(body.get("mappings", {}))
+
+        index = {}
+        for key, value in settings.items():
+            key = key[len("index."):] if key.startswith("index.") else key
+            index[key] = str(value).lower() if isinstance(value, bool) else str(value)
+        index.setdefault("number_of_shards", "1")
+        index.setdefault("number_of_replicas", "1")
+
+        self.indices[name] = {"docs": {}, "settings": index, "mappings": mappings}
+        return self.indices[name]
+
+    def resolve(self, expression: str, create: bool = False) -> list:
+        """
+        Resolve a comma separated list of index names, patterns and aliases
+        """
+        names = []
+        for part in expression.split(","):
+            if part in ("_all", "*"):
+                names.extend(self.indices)
+            elif "*" in part:
+                names.extend(name for name in self.indices if fnmatch(name, part))
+            elif part in self.aliases:
+                names.extend(sorted(self.aliases[part]))
+            elif part in self.indices:
+                names.append(part)
+            elif create:
+                self.create_index(part)
+                names.append(part)
+            else:
+                raise StandinError(404, "index_not_found_exception", f"no such index [{part}]")
+        return list(dict.fromkeys(names))
+
+    def write_index(self, name: str) -> str:
+        names = self.resolve(name, create=True)
+        if len(names) > 1:
+            raise StandinError(400, "illegal_argument_exception", f"no write index is defined for alias [{name}]")
+        return names[0]
+
+    def lookup(self, name: str):
+        """
+        Get the single index behind a name or alias, if there is one
+        """
+        names = self.aliases.get(name, {name})
+        return self.indices.get(next(iter(names))) if len(names) == 1 else None
+
+    def run_pipeline(self, index: dict, source: dict, pipeline: str = None) -> dict:
+        pipeline = pipeline or index["settings"].get("default_pipeline")
+        if not pipeline or pipeline == "_none":
+            return source
+        definition = self.pipelines.get(pipeline)
+        if definition is None:
+            raise StandinError(400, "illegal_argument_exception", f"pipeline with id [{pipeline}] does not exist")
+        for processor in definition.get("processors", []):
+            embedding = processor.get("text_embedding")
+            if embedding:
+                for source_field, target in embedding.get("field_map", {}).items():
+                    if source_field in source:
+                        source[target] = self.embed([source[source_field]])[0]
+        return source
+
+    def put_document(self, name: str, id: str, source: dict, pipeline: str = None) -> dict:
+        name = self.write_index(name)
+        index = self.indices[name]
+        source = self.run_pipeline(index, dict(source), pipeline)
+        created = id not in index["docs"]
+        index["docs"][id] = (next(self.sequence), source)
+        return {
+            "_index": name,
+            "_id": id,
+            "result": "created" if created else "updated",
+            "status": 201 if created else 200,
+        }
+
+    def delete_document(self, name: str, id: str) -> dict:
+        index = self.lookup(name)
+        if index is None or id not in index["docs"]:
+            return {"_index": name, "_id": id, "result": "not_found", "status": 404}
+        del index["docs"][id]
+        return {"_index": name, "_id": id, "result": "deleted", "status": 200}
+
+    # Queries
+
+    def evaluate(self, query: dict, docs: dict) -> dict:
+        """
+        Score the documents matching a query, by id
+        """
+        (kind, body), = query.items()
+
+        if kind == "match_all":
+            return {id: 1.0 for id in docs}
+
+        if kind == "match":
+            (field, text), = body.items()
+            if isinstance(text, dict):
+                text = text["query"]
+            wanted = set(tokens(text))
+            scores = {}
+            for id, (_, source) in docs.items():
+                score = sum(1.0 for token in tokens(field_value(source, field) or "") if token in wanted)
+                if score:
+                    scores[id] = score
+            return scores
+
+        if kind in ("term", "terms"):
+            (field, value), = ((key, value) for key, value in body.items() if key != "boost")
+            if isinstance(value, dict):
+                value = value["value"]
+            values = value if kind == "terms" else [value]
+            return {
+                id: 1.0
+                for id, (_, source) in docs.items()
+                if field_value(source, field) in values
+            }
+
+        if kind == "ids":
+            return {id: 1.0 for id in body["values"] if id in docs}
+
+        if kind == "bool":
+            return self.evaluate_bool(body, docs)
+
+        if kind in ("knn", "neural"):
+            (field, options), = body.items()
+            if kind == "neural":
+                vector = self.embed([options["query_text"]])[0]
+            else:
+                vector = options["vector"]
+            candidates = docs
+            if options.get("filter"):
+                matched = self.evaluate(options["filter"], docs)
+                candidates = {id: docs[id] for id in matched}
+            scores = {
+                id: l2_score(vector, source[field])
+                for id, (_, source) in candidates.items()
+                if source.get(field) is not None
+            }
+            top = sorted(scores.items(), key=lambda item: -item[1])[: options.get("k", 10)]
+            return dict(top)
+
+        if kind == "script_score":
+            scores = self.evaluate(body["query"], docs)
+            script = body["script"]
+            params = script.get("params", {})
+            if script.get("source") == "knn_score":
+                field = params["field"]
+                return {
+                    id: l2_score(params["query_value"], docs[id][1][field])
+                    for id in scores
+                    if docs[id][1].get(field) is not None
+                }
+            return {id: score * params.get("weight", 1.0) for id, score in scores.items()}
+
+        if kind == "hybrid":
+            return self.evaluate_hybrid(body["queries"], docs)
+
+        raise StandinError(400, "parsing_exception", f"unknown query [{kind}]")
+
+    def evaluate_bool(self, body: dict, docs: dict) -> dict:
+        def clauses(name):
+            value = body.get(name) or []
+            return value if isinstance(value, list) else [value]
+
+        candidates = dict(docs)
+        scores = {id: 0.0 for id in docs}
+
+        for clause in clauses("filter"):
+            matched = self.evaluate(clause, candidates)
+            candidates = {id: candidates[id] for id in matched}
+        for clause in clauses("must_not"):
+            matched = self.evaluate(clause, candidates)
+            candidates = {id: doc for id, doc in candidates.items() if id not in matched}
+        for clause in clauses("must"):
+            matched = self.evaluate(clause, candidates)
+            candidates = {id: candidates[id] for id in matched}
+            for id, score in matched.items():
+                scores[id] += score
+
+        should = clauses("should")
+        if should:
+            matched_any = set()
+            for clause in should:
+                for id, score in self.evaluate(clause, candidates).items():
+                    scores[id] += score
+                    matched_any.add(id)
+            required = body.get("minimum_should_match")
+            if required or not (clauses("must") or clauses("filter")):
+                candidates = {id: candidates[id] for id in matched_any}
+
+        return {id: scores[id] for id in candidates}
+
+    def evaluate_hybrid(self, queries: list, docs: dict, weights: list = None) -> dict:
+        weights = weights or [1 / len(queries)] * len(queries)
+        combined = {}
+        for query, weight in zip(queries, weights):
+            scores = self.evaluate(query, docs)
+            if not scores:
+                continue
+            low, high = min(scores.values()), max(scores.values())
+            for id, score in scores.items():
+                normalized = (score - low) / (high - low) if high > low else 1.0
+                combined[id] = combined.get(id, 0.0) + weight * normalized
+        return combined
+
+    def search(self, expression: str, payload: dict, params: dict) -> dict:
+        started = time.perf_counter()
+        payload = payload or {}
+
+        if "pit" in payload:
+            pit = self.pits.get(payload["pit"]["id"])
+            if pit is None:
+                raise StandinError(404, "search_context_missing_exception", "No search context found")
+            docs = pit
+        else:
+            docs = {}
+            for name in self.resolve(expression or "_all"):
+                for id, (sequence, source) in self.indices[name]["docs"].items():
+                    docs[id] = (sequence, source, name)
+
+        flat = {id: (entry[0], entry[1]) for id, entry in docs.items()}
+        query = payload.get("query", {"match_all": {}})
+        weights = None
+        pipeline = self.search_pipelines.get((params.get("search_pipeline") or [None])[0])
+        if pipeline and "hybrid" in query:
+            for processor in pipeline.get("phase_results_processors", []):
+                combination = processor.get("normalization-processor", {}).get("combination", {})
+                weights = combination.get("parameters", {}).get("weights")
+            scores = self.evaluate_hybrid(query["hybrid"]["queries"], flat, weights)
+        else:
+            scores = self.evaluate(query, flat)
+
+        sort = payload.get("sort")
+        hits = [(id, score) for id, score in scores.items()]
+        if sort:
+            hits.sort(key=lambda hit: self.sort_key(sort, hit, docs))
+        else:
+            hits.sort(key=lambda hit: (-hit[1], docs[hit[0]][0]))
+
+        if "search_after" in payload:
+            after = payload["search_after"]
+            hits = [hit for hit in hits if self.sort_values(sort, hit, docs, signed=True) > self.signed(sort, after)]
+
+        start = payload.get("from", 0)
+        size = payload.get("size", 10)
+        page = hits[start:start + size]
+
+        response = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "max_score": max((score for _, score in hits), default=None),
+                "hits": [self.hit(id, score, docs, payload, sort) for id, score in page],
+            },
+        }
+        if "pit" in payload:
+            response["pit_id"] = payload["pit"]["id"]
+        return response
+
+    def sort_fields(self, sort: list) -> list:
+        fields = []
+        for entry in sort:
+            if isinstance(entry, str):
+                fields.append((entry, "desc" if entry == "_score" else "asc"))
+            else:
+                (field, order), = entry.items()
+                if isinstance(order, dict):
+                    order = order.get("order", "asc")
+                fields.append((field, order))
+        return fields
+
+    def sort_values(self, sort: list, hit: tuple, docs: dict, signed: bool = False) -> list:
+        id, score = hit
+        values = []
+        for field, order in self.sort_fields(sort):
+            if field == "_score":
+                value = score
+            elif field == "_doc":
+                value = docs[id][0]
+            elif field == "_id":
+                value = id
+            else:
+                value = field_value(docs[id][1], field)
+            if signed and order == "desc" and isinstance(value, (int, float)):
+                value = -value
+            values.append(value)
+        return values
+
+    def signed(self, sort: list, values: list) -> list:
+        return [
+            -value if order == "desc" and isinstance(value, (int, float)) else value
+            for (_, order), value in zip(self.sort_fields(sort), values)
+        ]
+
+    def sort_key(self, sort: list, hit: tuple, docs: dict):
+        return self.sort_values(sort, hit, docs, signed=True)
+
+    def hit(self, id: str, score: float, docs: dict, payload: dict, sort: list) -> dict:
+        entry = docs[id]
+        hit = {
+            "_index": entry[2] if len(entry) > 2 else None,
+            "_id": id,
+            "_score": score,
+        }
+        source = self.filter_source(entry[1], payload.get("_source", True))
+        if source is not None:
+            hit["_source"] = source
+        if sort:
+            hit["sort"] = self.sort_values(sort, (id, score), docs)
+        return hit
+
+    def filter_source(self, source: dict, selection, includes=None, excludes=None):
+        if selection is False:
+            return None
+        if isinstance(selection, dict):
+            includes = selection.get("includes") or includes
+            excludes = selection.get("excludes") or excludes
+        elif isinstance(selection, list):
+            includes = selection
+        if includes:
+            source = {
+                key: value for key, value in source.items()
+                if any(key == field or field.startswith(f"{key}.") or fnmatch(key, field) for field in includes)
+            }
+        if excludes:
+            source = {
+                key: value for key, value in source.items()
+                if not any(key == field or fnmatch(key, field) for field in excludes)
+            }
+        return source
+
+    # Mustache
+
+    def render(self, template: str, params: dict) -> dict:
+        """
+        Render the subset of mustache used by stored search templates
+        """
+        template = re.sub(
+            r"\{\{#toJson\}\}(\w+)\{\{/toJson\}\}",
+            lambda match: codec.dumps(params.get(match.group(1))).decode(),
+            template,
+        )
+        template = re.sub(
+            r"\{\{#(\w+)\}\}(.*?)\{\{/\1\}\}",
+            lambda match: match.group(2) if params.get(match.group(1)) else "",
+            template,
+            flags=re.S,
+        )
+        template = re.sub(
+            r"\{\{(\w+)\}\}",
+            lambda match: codec.dumps(params.get(match.group(1))).decode(),
+            template,
+        )
+        return codec.loads(template)
+
+
+def ndjson(body: bytes) -> list:
+    return [codec.loads(line) for line in body.splitlines() if line.strip()]
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Route requests to the stand-in state
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    standin: Standin = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def do_HEAD(self):
+        self.dispatch("HEAD")
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        self.throttle(len(raw))
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        return raw
+
+    def throttle(self, size: int):
+        """
+        Spend the time size bytes take on a link capped at bandwidth bytes per second
+        """
+        if self.standin.bandwidth:
+            time.sleep(size / self.standin.bandwidth)
+
+    def reply(self, status: int, body):
+        data = codec.dumps(body)
+        compressed = self.standin.compression and "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if compressed:
+            data = gzip.compress(data, 1)
+        self.throttle(len(data))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def dispatch(self, method: str):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        raw = self.read_body()
+
+        if self.standin.latency:
+            time.sleep(self.standin.latency)
+
+        try:
+            if parts[-1:] == ["_bulk"]:
+                status, body = self.bulk(method, parts, params, raw)
+            else:
+                with self.standin.lock:
+                    status, body = route(self.standin, method, parts, params, raw)
+        except StandinError as error:
+            status, body = error.status, {
+                "error": {"type": error.type, "reason": error.reason},
+                "status": error.status,
+            }
+        except (KeyError, ValueError, TypeError) as error:
+            status, body = 400, {
+                "error": {"type": "parsing_exception", "reason": repr(error)},
+                "status": 400,
+            }
+        self.reply(status, body)
+
+    def bulk(self, method: str, parts: list, params: dict, raw: bytes):
+        """
+        Run a _bulk request through the bounded bulk queue, spending item_latency per document
+        """
+        standin = self.standin
+        with standin.bulk_lock:
+            if standin.bulk_queue and standin.bulk_active >= standin.bulk_queue:
+                raise StandinError(
+                    429,
+                    "es_rejected_execution_exception",
+                    f"rejected execution of bulk request: queue capacity [{standin.bulk_queue}] reached",
+                )
+            standin.bulk_active += 1
+        try:
+            started = time.perf_counter()
+            if standin.item_latency:
+                time.sleep(standin.item_latency * raw.count(b"\n") / 2)
+            with standin.lock:
+                status, body = route(standin, method, parts, params, raw)
+            body["took"] = int((time.perf_counter() - started) * 1000)
+            return status, body
+        finally:
+            with standin.bulk_lock:
+                standin.bulk_active -= 1
+
+
+def route(standin: Standin, method: str, parts: list, params: dict, raw: bytes):
+    """
+    Handle one request, returning its status and body
+    """
+    def param(name, default=None):
+        return params.get(name, [default])[0]
+
+    def body():
+        return codec.loads(raw) if raw else {}
+
+    if parts[:2] == ["v1", "embeddings"]:
+        payload = body()
+        texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        vectors = standin.embed(texts)
+        return 200, {
+            "object": "list",
+            "model": payload.get("model"),
+            "data": [
+                {"object": "embedding", "index": position, "embedding": vector}
+                for position, vector in enumerate(vectors)
+            ],
+        }
+
+    if not parts:
+        return 200, {"name": "standin", "version": {"distribution": "opensearch", "number": "2.17.0"}}
+
+    head = parts[0]
+
+    if head == "_cluster":
+        return 200, {"acknowledged": True}
+
+    if head == "_reindex":
+        return reindex(standin, body(), param("wait_for_completion", "true") != "false")
+
+    if head == "_tasks":
+        task = standin.tasks.get(parts[1])
+        if task is None:
+            raise StandinError(404, "resource_not_found_exception", f"task [{parts[1]}] isn't running and hasn't stored its results")
+        return 200, task
+
+    if head == "_alias":
+        members = standin.aliases.get(parts[1])
+        if not members:
+            return 404, {"error": f"alias [{parts[1]}] missing", "status": 404}
+        return 200, {name: {"aliases": {parts[1]: {}}} for name in sorted(members)}
+
+    if head == "_aliases":
+        return 200, update_aliases(standin, body()["actions"])
+
+    if head == "_bulk" or parts[-1:] == ["_bulk"]:
+        return 200, bulk(standin, parts[0] if head != "_bulk" else None, raw, param("pipeline"))
+
+    if head == "_msearch" or parts[-1:] == ["_msearch"]:
+        return 200, msearch(standin, parts[0] if head != "_msearch" else None, raw, params)
+
+    if head == "_template":
+        if method == "DELETE":
+            standin.templates.pop(parts[1], None)
+        else:
+            standin.templates[parts[1]] = body()
+        return 200, {"acknowledged": True}
+
+    if head == "_index_template":
+        return 200, {"acknowledged": True}
+
+    if head == "_ingest":
+        if method == "DELETE":
+            standin.pipelines.pop(parts[2], None)
+        elif method == "GET":
+            return 200, {parts[2]: standin.pipelines[parts[2]]}
+        else:
+            standin.pipelines[parts[2]] = body()
+        return 200, {"acknowledged": True}
+
+    if head == "_scripts":
+        if method == "DELETE":
+            standin.scripts.pop(parts[1], None)
+        else:
+            standin.scripts[parts[1]] = body()["script"]
+        return 200, {"acknowledged": True}
+
+    if head == "_search" and parts[1:2] == ["pipeline"]:
+        if method == "DELETE":
+            standin.search_pipelines.pop(parts[2], None)
+        else:
+            standin.search_pipelines[parts[2]] = body()
+        return 200, {"acknowledged": True}
+
+    if head == "_search" and parts[1:2] == ["point_in_time"]:
+        for pit_id in body().get("pit_id", []):
+            standin.pits.pop(pit_id, None)
+        return 200, {"pits": [{"successful": True}]}
+
+    if head == "_search":
+        return 200, standin.search(None, body(), params)
+
+    if head == "_plugins" and parts[1] == "_ml":
+        return ml(standin, method, parts[2:], body())
+
+    index = head
+    rest = parts[1:]
+
+    if not rest:
+        if method == "PUT":
+            if index in standin.indices or index in standin.aliases:
+                raise StandinError(400, "resource_already_exists_exception", f"index [{index}] already exists")
+            standin.create_index(index, body())
+            return 200, {"acknowledged": True, "index": index}
+        if method == "DELETE":
+            names = standin.resolve(index)
+            for name in names:
+                del standin.indices[name]
+                for alias, members in list(standin.aliases.items()):
+                    members.discard(name)
+                    if not members:
+                        del standin.aliases[alias]
+            return 200, {"acknowledged": True}
+        if method == "HEAD":
+            return (200 if index in standin.indices or index in standin.aliases else 404), {}
+        names = standin.resolve(index)
+        return 200, {name: {"settings": {"index": standin.indices[name]["settings"]}} for name in names}
+
+    if rest[0] == "_doc":
+        if method in ("PUT", "POST"):
+            id = rest[1] if len(rest) > 1 else uuid.uuid4().hex
+            result = standin.put_document(index, id, body(), param("pipeline"))
+            return result.pop("status"), result
+        if method == "DELETE":
+            result = standin.delete_document(index, rest[1])
+            return result.pop("status"), result
+        entry = (standin.lookup(index) or {"docs": {}})["docs"].get(rest[1])
+        if entry is None:
+            return 404, {"_index": index, "_id": rest[1], "found": False}
+        source = standin.filter_source(
+            entry[1],
+            True,
+            [field for field in (param("_source_includes") or "").split(",") if field],
+            [field for field in (param("_source_excludes") or "").split(",") if field],
+        )
+        return 200, {"_index": index, "_id": rest[1], "found": True, "_source": source}
+
+    if rest[0] == "_search":
+        if rest[1:2] == ["point_in_time"]:
+            names = standin.resolve(index)
+            snapshot = {}
+            for name in names:
+                for id, (sequence, source) in standin.indices[name]["docs"].items():
+                    snapshot[id] = (sequence, source, name)
+            pit_id = uuid.uuid4().hex
+            standin.pits[pit_id] = snapshot
+            return 200, {"pit_id": pit_id, "creation_time": int(time.time() * 1000)}
+        if rest[1:2] == ["template"]:
+            payload = body()
+            source = standin.scripts[payload["id"]]["source"]
+            return 200, standin.search(index, standin.render(source, payload.get("params", {})), params)
+        return 200, standin.search(index, body(), params)
+
+    if rest[0] == "_settings":
+        names = standin.resolve(index)
+        if method == "PUT":
+            settings = body().get("index", body())
+            for name in names:
+                current = standin.indices[name]["settings"]
+                for key, value in settings.items():
+                    if value is None:
+                        current.pop(key, None)
+                    else:
+                        current[key] = str(value)
+            return 200, {"acknowledged": True}
+        return 200, {name: {"settings": {"index": standin.indices[name]["settings"]}} for name in names}
+
+    if rest[0] == "_mget":
+        payload = body()
+        ids = payload.get("ids") or [doc["_id"] for doc in payload.get("docs", [])]
+        includes = [field for field in (param("_source_includes") or "").split(",") if field]
+        excludes = [field for field in (param("_source_excludes") or "").split(",") if field]
+        docs = []
+        for id in ids:
+            entry = (standin.lookup(index) or {"docs": {}})["docs"].get(id)
+            if entry is None:
+                docs.append({"_index": index, "_id": id, "found": False})
+            else:
+                source = standin.filter_source(entry[1], True, includes, excludes)
+                docs.append({"_index": index, "_id": id, "found": True, "_source": source})
+        return 200, {"docs": docs}
+
+    if rest[0] == "_delete_by_query":
+        started = time.perf_counter()
+        deleted = 0
+        for name in standin.resolve(index):
+            docs = standin.indices[name]["docs"]
+            for id in standin.evaluate(body().get("query", {"match_all": {}}), docs):
+                del docs[id]
+                deleted += 1
+        return 200, {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "total": deleted,
+            "deleted": deleted,
+            "batches": 1,
+            "version_conflicts": 0,
+            "failures": [],
+        }
+
+    if rest[0] in ("_refresh", "_forcemerge", "_flush"):
+        standin.resolve(index)
+        return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    if rest[0] == "_count":
+        return 200, {"count": standin.search(index, {**body(), "size": 0}, params)["hits"]["total"]["value"]}
+
+    raise StandinError(400, "illegal_argument_exception", f"unsupported endpoint [{method} /{'/'.join(parts)}]")
+
+
+def bulk(standin: Standin, default_index: str, raw: bytes, pipeline: str = None) -> dict:
+    started = time.perf_counter()
+    lines = ndjson(raw)
+    items, errors = [], False
+    position = 0
+    while position < len(lines):
+        action = lines[position]
+        (op, meta), = action.items()
+        index = meta.get("_index", default_index)
+        position += 1
+        try:
+            if op == "delete":
+                result = standin.delete_document(index, meta["_id"])
+            else:
+                source = lines[position]
+                position += 1
+                result = standin.put_document(
+                    index, meta.get("_id") or uuid.uuid4().hex, source, meta.get("pipeline", pipeline)
+                )
+        except StandinError as error:
+            errors = True
+            result = {
+                "_index": index,
+                "_id": meta.get("_id"),
+                "status": error.status,
+                "error": {"type": error.type, "reason": error.reason},
+            }
+        items.append({op: result})
+    return {"took": int((time.perf_counter() - started) * 1000), "errors": errors, "items": items}
+
+
+def msearch(standin: Standin, default_index: str, raw: bytes, params: dict) -> dict:
+    started = time.perf_counter()
+    lines = ndjson(raw)
+    responses = []
+    for header, payload in zip(lines[::2], lines[1::2]):
+        try:
+            response = standin.search(header.get("index", default_index), payload, params)
+            response["status"] = 200
+        except StandinError as error:
+            response = {"error": {"type": error.type, "reason": error.reason}, "status": error.status}
+        responses.append(response)
+    return {"took": int((time.perf_counter() - started) * 1000), "responses": responses}
+
+
+def reindex(standin: Standin, payload: dict, wait_for_completion: bool = True):
+    started = time.perf_counter()
+    dest = payload["dest"]
+    names = standin.resolve(payload["source"]["index"])
+    created = updated = 0
+    for name in names:
+        for id, (_, source) in list(standin.indices[name]["docs"].items()):
+            result = standin.put_document(dest["index"], id, codec.loads(codec.dumps(source)), dest.get("pipeline"))
+            if result["result"] == "created":
+                created += 1
+            else:
+                updated += 1
+
+    status = {
+        "total": created + updated,
+        "created": created,
+        "updated": updated,
+        "deleted": 0,
+        "batches": 1,
+        "version_conflicts": 0,
+        "noops": 0,
+    }
+    response = {"took": int((time.perf_counter() - started) * 1000), "timed_out": False, **status, "failures": []}
+    if wait_for_completion:
+        return 200, response
+
+    task_id = f"standin:{next(standin.sequence)}"
+    standin.tasks[task_id] = {
+        "completed": True,
+        "task": {
+            "id": task_id,
+            "action": "indices:data/write/reindex",
+            "status": status,
+            "running_time_in_nanos": int((time.perf_counter() - started) * 1e9),
+        },
+        "response": response,
+    }
+    return 200, {"task": task_id}
+
+
+def update_aliases(standin: Standin, actions: list) -> dict:
+    aliases = {alias: set(members) for alias, members in standin.aliases.items()}
+    resolved = []
+    for action in actions:
+        (kind, options), = action.items()
+        indices = standin.resolve(options.get("index") or ",".join(options.get("indices", [])))
+        resolved.append((kind, options, indices))
+    removed = {name for kind, _, indices in resolved if kind == "remove_index" for name in indices}
+
+    for kind, options, indices in resolved:
+        alias_names = [options["alias"]] if "alias" in options else options.get("aliases", [])
+        for alias in alias_names:
+            if kind == "add":
+                if alias in standin.indices and alias not in removed:
+                    raise StandinError(
+                        400, "invalid_alias_name_exception", f"an index exists with the same name as the alias [{alias}]"
+                    )
+                aliases.setdefault(alias, set()).update(indices)
+            elif kind == "remove":
+                if not aliases.get(alias, set()) & set(indices):
+                    raise StandinError(404, "aliases_not_found_exception", f"aliases [{alias}] missing")
+                aliases[alias] -= set(indices)
+
+    for name in removed:
+        del standin.indices[name]
+        for members in aliases.values():
+            members.discard(name)
+    standin.aliases = {alias: members for alias, members in aliases.items() if members}
+    return {"acknowledged": True}
+
+
+def ml(standin: Standin, method: str, parts: list, payload: dict):
+    state = standin.ml
+
+    def task(**fields):
+        task_id = uuid.uuid4().hex
+        state["tasks"][task_id] = {"state": "COMPLETED", **fields}
+        return task_id
+
+    def search(kind):
+        query = payload.get("query", {"match_all": {}})
+        name = query.get("match", {}).get("name")
+        if isinstance(name, dict):
+            name = name.get("query")
+        hits = [
+            {"_id": id, "_source": source}
+            for id, source in state[kind].items()
+            if name is None or set(tokens(name)) & set(tokens(source.get("name", "")))
+        ]
+        return 200, {"hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits[: payload.get("size", 10)]}}
+
+    kind = parts[0]
+
+    if kind == "tasks":
+        if parts[1] == "_search":
+            return 200, {"hits": {"hits": [{"_id": id, "_source": task} for id, task in state["tasks"].items()]}}
+        return 200, state["tasks"].get(parts[1]) or {"error": {"type": "status_exception", "reason": "Task not found"}, "status": 404}
+
+    if kind == "_predict":
+        vectors = standin.embed(payload["text_docs"])
+        return 200, {
+            "inference_results": [
+                {"output": [{"name": "sentence_embedding", "data_type": "FLOAT32", "shape": [len(vector)], "data": vector}]}
+                for vector in vectors
+            ]
+        }
+
+    if kind in ("model_groups", "connectors", "models"):
+        if parts[1] == "_search":
+            return search(kind)
+        if parts[1] in ("_register", "_create", "_upload"):
+            id = uuid.uuid4().hex
+            state[kind][id] = {**payload, "model_state": "REGISTERED"} if kind == "models" else payload
+            if kind == "model_groups":
+                return 200, {"model_group_id": id, "status": "CREATED"}
+            if kind == "connectors":
+                return 200, {"connector_id": id}
+            return 200, {"task_id": task(model_id=id), "status": "CREATED", "model_id": id}
+
+        id = parts[1]
+        if id not in state[kind]:
+            return 404, {"error": {"type": "status_exception", "reason": f"Failed to find {kind} {id}"}, "status": 404}
+        action = parts[2] if len(parts) > 2 else None
+        if action in ("_deploy", "_load"):
+            state[kind][id]["model_state"] = "DEPLOYED"
+            return 200, {"task_id": task(model_id=id), "task_type": "DEPLOY_MODEL", "status": "CREATED"}
+        if action in ("_undeploy", "_unload"):
+            state[kind][id]["model_state"] = "UNDEPLOYED"
+            return 200, {}
+        if method == "DELETE":
+            if kind == "model_groups" and any(
+                model.get("model_group_id") == id for model in state["models"].values()
+            ):
+                return 409, {"error": {"type": "illegal_argument_exception", "reason": "Model group has models"}, "status": 409}
+            del state[kind][id]
+            return 200, {"_id": id, "result": "deleted"}
+        return 200, state[kind][id]
+
+    raise StandinError(400, "illegal_argument_exception", f"unsupported ML endpoint [{'/'.join(parts)}]")
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 9200,
+    standin: Standin = None,
+) -> ThreadingHTTPServer:
+    """
+    Create a threaded HTTP server for a stand-in; call serve_forever to run it
+    """
+    handler = type("StandinHandler", (Handler,), {"standin": standin or Standin()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start(standin: Standin = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Serve a stand-in from a background thread, on an ephemeral port by default
+    """
+    server = serve(host, port, standin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
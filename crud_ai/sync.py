@@ -0,0 +1,125 @@
+"""
+Incremental synchronization of a corpus with an index
+"""
+
+import time
+from itertools import chain
+from typing import Dict, Iterable, Iterator
+
+from crud_ai import codec
+from crud_ai.embeddings import Embedder, content_hash
+from crud_ai.ingest import batched
+from crud_ai.opensearch import (
+    BULK_CHUNK_SIZE,
+    BULK_MAX_CHUNK_BYTES,
+    bulk,
+    document_source,
+    get_index_settings,
+    scan_documents,
+)
+
+HASH_FIELD = "content_hash"
+
+
+def document_hash(document: dict) -> str:
+    """
+    Hash everything that is indexed for a document, except the stored hash itself
+    """
+    meta = {key: value for key, value in (document.get("meta") or {}).items() if key != HASH_FIELD}
+    return content_hash(
+        codec.dumps(
+            [document["content"], document.get("content_type", "text/plain"), meta],
+            sort_keys=True,
+        ).decode()
+    )
+
+
+def existing_hashes(index: str = "documents", size: int = 5000) -> Dict[str, str]:
+    """
+    Fetch the stored hash of every document in an index, by id
+    """
+    if get_index_settings(index).get("status") == 404:
+        return {}
+    return {
+        hit["_id"]: hit.get("_source", {}).get("meta", {}).get(HASH_FIELD)
+        for hit in scan_documents(index, size=size, source_includes=[f"meta.{HASH_FIELD}"])
+    }
+
+
+def sync(
+    documents: Iterable[dict],
+    index: str = "documents",
+    pipeline: str = None,
+    delete: bool = True,
+    dry_run: bool = False,
+    embedder: Embedder = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+) -> dict:
+    """
+    Index new and changed documents and delete removed ones in a single bulk stream
+
+    Each document's hash is stored in meta.content_hash and compared with the
+    hashes already in the index, so unchanged documents are neither sent nor
+    re-embedded. With an embedder only changed documents are embedded.
+    """
+    started = time.perf_counter()
+    existing = existing_hashes(index)
+    counts = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0}
+    seen = set()
+
+    def changed() -> Iterator[dict]:
+        for document in documents:
+            id = str(document["id"])
+            seen.add(id)
+            digest = document_hash(document)
+            if existing.get(id) == digest:
+                counts["unchanged"] += 1
+                continue
+            counts["changed" if id in existing else "added"] += 1
+            yield {**document, "id": id, "meta": {**(document.get("meta") or {}), HASH_FIELD: digest}}
+
+    def upserts():
+        updates = changed()
+        if embedder:
+            updates = chain.from_iterable(
+                embedder.embed_documents(batch) for batch in batched(updates, embedder.batch_size)
+            )
+        for document in updates:
+            yield (
+                {"index": {"_id": document["id"]}},
+                document_source(
+                    document["content"],
+                    document.get("content_type", "text/plain"),
+                    document["meta"],
+                    document.get("embedding"),
+                ),
+            )
+
+    def deletes():
+        if not delete:
+            return
+        for id in existing.keys() - seen:
+            counts["removed"] += 1
+            yield {"delete": {"_id": id}}, None
+
+    actions = chain(upserts(), deletes())
+
+    if dry_run:
+        for _ in actions:
+            pass
+        summary = None
+    else:
+        summary = bulk(
+            actions,
+            index=index,
+            pipeline="_none" if embedder and not pipeline else pipeline,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+        )
+
+    return {
+        **counts,
+        "bulk": summary,
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,119 @@
+"""
+Concurrent teardown of ML models, model groups and connectors
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from crud_ai.opensearch import (
+    delete_model,
+    delete_model_group,
+    request,
+    search_connectors,
+    search_model_groups,
+    search_models,
+    undeploy_model,
+    wait_until,
+)
+
+DISCOVERY_SIZE = 10000
+
+
+def _hit_ids(response: dict, name: str = None) -> List[str]:
+    """
+    Get the ids of search hits, only those named exactly name when one is given
+
+    name is analyzed text, so a match query on it also returns resources that
+    merely share a token with name.
+    """
+    return [
+        hit["_id"]
+        for hit in response.get("hits", {}).get("hits", [])
+        if not name or hit.get("_source", {}).get("name") == name
+    ]
+
+
+def discover(model_group: str = None, connector: str = None) -> dict:
+    """
+    Find every model, and the model groups and connectors with exactly the given names
+    """
+    with ThreadPoolExecutor(3) as executor:
+        models = executor.submit(search_models, DISCOVERY_SIZE)
+        model_groups = executor.submit(search_model_groups, model_group, DISCOVERY_SIZE)
+        connectors = executor.submit(search_connectors, connector, DISCOVERY_SIZE)
+
+        return {
+            "models": _hit_ids(models.result()),
+            "model_groups": _hit_ids(model_groups.result(), model_group),
+            "connectors": _hit_ids(connectors.result(), connector),
+        }
+
+
+def _remove_model(model_id: str) -> dict:
+    undeploy_model(model_id)
+    return delete_model(model_id)
+
+
+def _remove_connector(connector_id: str) -> dict:
+    return request("delete", f"_plugins/_ml/connectors/{connector_id}")
+
+
+def _submit(executor: ThreadPoolExecutor, remove: Callable[[str], dict], ids: List[str]) -> list:
+    return [(id, executor.submit(remove, id)) for id in ids]
+
+
+def _collect(futures: list) -> dict:
+    """
+    Sort removed resource ids into deleted and failed
+    """
+    summary = {"deleted": [], "failed": []}
+    for id, future in futures:
+        try:
+            response = future.result()
+        except Exception as error:
+            summary["failed"].append({"id": id, "error": str(error)})
+            continue
+        if "error" in response:
+            summary["failed"].append({"id": id, "error": response["error"]})
+        else:
+            summary["deleted"].append(id)
+    return summary
+
+
+def teardown(
+    model_group: str = None,
+    connector: str = None,
+    workers: int = 8,
+    timeout: float = 60.0,
+) -> dict:
+    """
+    Undeploy and delete all models, then the matching model groups and connectors
+
+    Models go first since model groups and connectors cannot be deleted while
+    models still refer to them.
+    """
+    started = time.monotonic()
+    resources = discover(model_group, connector)
+    summary = {}
+
+    with ThreadPoolExecutor(workers) as executor:
+        summary["models"] = _collect(
+            _submit(executor, _remove_model, resources["models"])
+        )
+
+        deleted = set(summary["models"]["deleted"])
+        if deleted:
+            wait_until(
+                lambda: None if deleted & set(_hit_ids(search_models(DISCOVERY_SIZE))) else True,
+                timeout,
+                "models to be deleted",
+            )
+
+        model_groups = _submit(executor, delete_model_group, resources["model_groups"])
+        connectors = _submit(executor, _remove_connector, resources["connectors"])
+        summary["model_groups"] = _collect(model_groups)
+        summary["connectors"] = _collect(connectors)
+
+    summary["elapsed"] = round(time.monotonic() - started, 3)
+    return summary
@@ -0,0 +1,117 @@
+"""
+Adaptive (AIMD) control of bulk batch size and concurrency
+"""
+
+import threading
+import time
+
+REJECTED_ERROR_TYPES = {"es_rejected_execution_exception", "rejected_execution_exception"}
+
+
+def is_rejection(status: int, error) -> bool:
+    """
+    Tell whether a bulk item or request failed because the cluster shed load
+    """
+    if status == 429:
+        return True
+    return isinstance(error, dict) and error.get("type") in REJECTED_ERROR_TYPES
+
+
+def rejected_ids(summary: dict) -> set:
+    """
+    Get the ids of the documents in a bulk summary that were rejected and can be retried
+    """
+    ids = set()
+    for error in summary["errors"]:
+        if not is_rejection(error.get("status"), error.get("error")):
+            continue
+        if "_ids" in error:
+            ids.update(id for id in error["_ids"] if id is not None)
+        elif error.get("_id") is not None:
+            ids.add(error["_id"])
+    return ids
+
+
+class Throttle:
+    """
+    Additive-increase, multiplicative-decrease controller for bulk ingestion
+
+    Every bulk round trip without rejections adds about one unit of
+    concurrency per round of in-flight requests. A server took above
+    target_took shrinks the batch size, and one well under it grows the batch
+    by batch_step. Rejections cut both concurrency and batch size by
+    decrease, at most once per round: responses to requests sent before the
+    last cut do not cut again.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        concurrency: int = 2,
+        min_batch_size: int = 50,
+        max_batch_size: int = 5000,
+        max_concurrency: int = 8,
+        target_took: float = 2000.0,
+        batch_step: int = 100,
+        decrease: float = 0.5,
+    ):
+        self.lock = threading.Lock()
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.target_took = target_took
+        self.batch_step = batch_step
+        self.decrease = decrease
+        self._batch_size = float(batch_size)
+        self._concurrency = float(concurrency)
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.rejections = 0
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def batch_size(self) -> int:
+        return int(self._batch_size)
+
+    @property
+    def concurrency(self) -> int:
+        return int(self._concurrency)
+
+    def observe(self, started: float, took: float, items: int, rejected: int):
+        """
+        Adjust to the outcome of a bulk request sent at started (time.monotonic)
+
+        took is the server time in milliseconds for items documents, of which
+        rejected were turned away.
+        """
+        with self.lock:
+            self.requests += 1
+            self.rejections += rejected
+
+            if rejected:
+                if started >= self.last_decrease:
+                    self._concurrency = max(1.0, self._concurrency * self.decrease)
+                    self._batch_size = max(self.min_batch_size, self._batch_size * self.decrease)
+                    self.last_decrease = time.monotonic()
+                    self.decreases += 1
+                return
+
+            self._concurrency = min(self.max_concurrency, self._concurrency + 1 / self._concurrency)
+
+            if took > self.target_took and items:
+                self._batch_size = max(self.min_batch_size, self._batch_size * self.target_took / took)
+                self.decreases += 1
+            elif took < self.target_took / 2 and items >= self.batch_size:
+                self._batch_size = min(self.max_batch_size, self._batch_size + self.batch_step)
+                self.increases += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "rejections": self.rejections,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
@@ -0,0 +1,150 @@
+"""
+HTTP transport for the OpenSearch service
+"""
+
+import gzip
+import time
+from fnmatch import fnmatch
+from typing import Iterable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crud_ai import codec
+from crud_ai.instrumentation import Metrics, current_operation
+from crud_ai.config import (
+    OPENSEARCH_COMPRESS_REQUESTS,
+    OPENSEARCH_COMPRESS_RESPONSES,
+    OPENSEARCH_COMPRESSION_LEVEL,
+    OPENSEARCH_COMPRESSION_MIN_BYTES,
+    OPENSEARCH_CONNECT_TIMEOUT,
+    OPENSEARCH_HOST,
+    OPENSEARCH_POOL_SIZE,
+    OPENSEARCH_TIMEOUT,
+)
+
+
+class Compression:
+    """
+    Per-operation gzip negotiation for request and response bodies
+
+    Patterns are matched against logical operation names (see
+    crud_ai.instrumentation.operation), such as "bulk" or "search_*".
+    Request bodies of matching operations are gzipped once they reach
+    min_bytes. Other operations ask for uncompressed responses.
+    """
+
+    def __init__(
+        self,
+        requests: Iterable[str] = OPENSEARCH_COMPRESS_REQUESTS,
+        responses: Iterable[str] = OPENSEARCH_COMPRESS_RESPONSES,
+        min_bytes: int = OPENSEARCH_COMPRESSION_MIN_BYTES,
+        level: int = OPENSEARCH_COMPRESSION_LEVEL,
+    ):
+        self.requests = tuple(requests)
+        self.responses = tuple(responses)
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def encode(self, operation: str, body: bytes, headers: dict) -> tuple:
+        """
+        Get the body and headers to send for an operation
+        """
+        headers = dict(headers or {})
+        if (
+            isinstance(body, bytes)
+            and len(body) >= self.min_bytes
+            and any(fnmatch(operation, pattern) for pattern in self.requests)
+        ):
+            body = gzip.compress(body, self.level)
+            headers["Content-Encoding"] = "gzip"
+        if not any(fnmatch(operation, pattern) for pattern in self.responses):
+            headers["Accept-Encoding"] = "identity"
+        return body, headers
+
+
+def received_bytes(response) -> int:
+    """
+    Get the size of a response body on the wire, before any decompression
+    """
+    return int(response.headers.get("Content-Length") or len(response.content))
+
+
+class Transport:
+    """
+    Pooled, keep-alive HTTP transport backed by a shared requests session
+    """
+
+    def __init__(
+        self,
+        host: str = OPENSEARCH_HOST,
+        pool_size: int = OPENSEARCH_POOL_SIZE,
+        connect_timeout: float = OPENSEARCH_CONNECT_TIMEOUT,
+        timeout: float = OPENSEARCH_TIMEOUT,
+        session: requests.Session = None,
+        instrumentation: Metrics = None,
+        compression: Compression = None,
+    ):
+        self.host = host.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, timeout)
+        self.session = session or requests.Session()
+        self.instrumentation = instrumentation
+        self.compression = compression or Compression()
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=True,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def perform(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request and return the raw response
+
+        A json body is serialized with the fast codec rather than by requests,
+        and the body and accepted encodings follow the compression settings.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if kwargs.get("json") is not None:
+            kwargs["data"] = codec.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {"Content-Type": "application/json", **(kwargs.get("headers") or {})}
+        kwargs["data"], kwargs["headers"] = self.compression.encode(
+            current_operation(method, path), kwargs.get("data"), kwargs.get("headers")
+        )
+        return self.session.request(method, f"{self.host}/{path}", **kwargs)
+
+    def request(self, method: str, path: str, **kwargs):
+        """
+        Send a request and return the decoded JSON body, recording it when instrumented
+        """
+        if self.instrumentation is None:
+            return codec.loads(self.perform(method, path, **kwargs).content)
+
+        started = time.perf_counter()
+        response = self.perform(method, path, **kwargs)
+        seconds = time.perf_counter() - started
+        body = codec.loads(response.content)
+        self.instrumentation.record(
+            current_operation(method, path),
+            response.status_code,
+            seconds,
+            len(response.request.body or b""),
+            received_bytes(response),
+            body,
+        )
+        return body
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()